@@ -0,0 +1,160 @@
+import os
+import json
+import shutil
+import hashlib
+import shapely
+import pandas as pd
+import geopandas as gpd
+from typing import Union
+from shapely.geometry import Polygon, MultiPolygon
+from collector import PipelineContext, OSM_TAGS, fetch_layers_single_query, fetch_layers_from_extract, enrich_layers
+from collector import get_city_and_region_from_polygon, data_source_key
+from utils import choose_frt_file, modify_address_to_join, merge_osm_frt, extract_districts_features
+from preprocessor import TagVocabulary, points_to_lists, lists_to_points
+from dataset_io import make_parquet_safe
+
+# Модули, от кода которых зависят результаты этапов (изменение любого из них делает старые чекпоинты недействительными)
+PIPELINE_MODULES = ['collector.py', 'osm_extract.py', 'schema.py', 'preprocessor.py', 'utils.py', 'geometry.py', 'dataset_io.py', 'checkpoints.py']
+
+# Этапы конвейера по порядку: сырые слои OSM, здания и районы, соединение с ФРТ, итоговый датасет районов
+STAGES = ['raw_layers', 'enriched', 'frt_merge', 'dataset']
+
+
+# Функция для получения версии кода (хэш исходников модулей конвейера)
+def code_version() -> str:
+    
+    version = hashlib.sha1()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for module in PIPELINE_MODULES:
+        with open(os.path.join(folder, module), 'rb') as file:
+            version.update(file.read())
+    
+    return version.hexdigest()
+
+# Функция для получения ключа чекпоинтов по полигону, параметрам запуска и версии кода
+def checkpoint_key(polygon: Union[Polygon, MultiPolygon], params: dict) -> str:
+    
+    key = hashlib.sha1(shapely.to_wkb(shapely.normalize(polygon)))
+    key.update(json.dumps(params, sort_keys = True, ensure_ascii = False).encode())
+    key.update(code_version().encode())
+    
+    return key.hexdigest()
+
+# Функция для получения ключа чекпоинтов города: параметры запуска, источник данных OSM и данные ФРТ
+def place_checkpoint_key(polygon: Union[Polygon, MultiPolygon], only_people: bool, frt: str, extract_path: str = None) -> str:
+    return checkpoint_key(polygon, {'only_people': only_people, 'tags': OSM_TAGS, 'frt': frt,
+                                    'source': data_source_key(extract_path)})
+
+# Функция для сохранения этапа (словарь {название: датафрейм}) в колоночном гео-формате
+# Файл _SUCCESS пишется последним, этап без него считается недействительным
+def save_stage(folder: str, key: str, stage: str, frames: dict) -> None:
+    
+    stage_path = os.path.join(folder, key, stage)
+    tmp_path = f'{stage_path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors = True)
+    os.makedirs(tmp_path)
+    
+    for name, frame in frames.items():
+        frame = make_parquet_safe(frame)
+        frame.columns = [str(column) for column in frame.columns]
+        frame.to_parquet(os.path.join(tmp_path, f'{name}.parquet'))
+    open(os.path.join(tmp_path, '_SUCCESS'), 'w').close()
+    
+    shutil.rmtree(stage_path, ignore_errors = True)
+    os.replace(tmp_path, stage_path)
+
+# Функция для загрузки этапа, возвращает None, если чекпоинта нет или он поврежден
+def load_stage(folder: str, key: str, stage: str) -> Union[dict, None]:
+    
+    stage_path = os.path.join(folder, key, stage)
+    if not os.path.exists(os.path.join(stage_path, '_SUCCESS')):
+        return None
+    
+    frames = {}
+    try:
+        for file in os.listdir(stage_path):
+            if not file.endswith('.parquet'):
+                continue
+            path = os.path.join(stage_path, file)
+            try:
+                frames[file[:-len('.parquet')]] = gpd.read_parquet(path)
+            except ValueError:
+                # в файле нет геометрии
+                frames[file[:-len('.parquet')]] = pd.read_parquet(path)
+    except Exception as e:
+        print(f'Чекпоинт {stage} поврежден: {type(e).__name__}')
+        return None
+    
+    return frames
+
+# Функция, загружающая этап из чекпоинта или вычисляющая и сохраняющая его
+def load_or_compute(folder: str, key: str, stage: str, compute, verbose: bool = False) -> dict:
+    
+    frames = load_stage(folder, key, stage)
+    if frames is not None:
+        if verbose:
+            print(f'{stage}: загружен из чекпоинта')
+        return frames
+    
+    frames = compute()
+    save_stage(folder, key, stage, frames)
+    if verbose:
+        print(f'{stage}: вычислен и сохранен')
+    
+    return frames
+
+# Функция для обработки одного города с чекпоинтами после каждого этапа
+# Этапы вычисляются лениво от последнего: если есть действительный чекпоинт позднего этапа, ранние не загружаются
+# last_stage - последний нужный этап ('frt_merge' - датасет зданий, 'dataset' - еще и датасет районов)
+# Теги точек внутри зданий сохраняются списками (строка - points_row) и возвращаются матрицей по словарю vocabulary
+# extract_path - локальная выгрузка OSM вместо Overpass
+def run_place_checkpointed(place_name: str, polygon: Union[Polygon, MultiPolygon], only_people: bool,
+                           frt_folder: str = 'frt_datasets', frt_store: str = None, admin_boundaries: str = None,
+                           folder: str = 'checkpoints', last_stage: str = 'dataset', verbose: bool = False,
+                           vocabulary: TagVocabulary = None, extract_path: str = None) -> dict:
+    
+    key = place_checkpoint_key(polygon, only_people, frt_store or frt_folder, extract_path)
+    if vocabulary is None:
+        vocabulary = TagVocabulary()
+    
+    # этапы, уже загруженные или вычисленные в этом вызове, повторно с диска не читаются
+    stages = {}
+    def stage(name: str, compute) -> dict:
+        if name not in stages:
+            stages[name] = load_or_compute(folder, key, name, compute, verbose)
+        return stages[name]
+    
+    def raw_layers():
+        if extract_path is not None:
+            return fetch_layers_from_extract(extract_path, polygon, OSM_TAGS, verbose)
+        return fetch_layers_single_query(polygon, OSM_TAGS, verbose)
+    
+    def enriched():
+        context = PipelineContext(place_name = place_name, extract_path = extract_path, points_vocabulary = vocabulary)
+        enrich_layers(stage('raw_layers', raw_layers), polygon, only_people, context)
+        points_inside = pd.DataFrame({'points_inside': points_to_lists(context.points_inside, vocabulary)})
+        return {'buildings': context.buildings, 'landuse_districts': context.landuse_districts,
+                'transport_districts': context.transport_districts, 'points_inside': points_inside}
+    
+    # теги точек сохраняются и в этом этапе, чтобы при действительном чекпоинте не читать большой этап enriched
+    def frt_merge():
+        enriched_frames = stage('enriched', enriched)
+        city_region = get_city_and_region_from_polygon(polygon, boundaries = admin_boundaries)
+        frt_data = choose_frt_file(city_region, frt_folder, store = frt_store)
+        buildings = modify_address_to_join(enriched_frames['buildings'].copy())
+        return {'buildings': merge_osm_frt(df_osm = buildings, df_frt = frt_data), 'points_inside': enriched_frames['points_inside']}
+    
+    def dataset():
+        buildings = stage('frt_merge', frt_merge)['buildings']
+        landuse_districts = stage('enriched', enriched)['landuse_districts']
+        districts = extract_districts_features(buildings, landuse_districts, ['element_type_landuse', 'osmid_landuse'])
+        return {'districts': districts}
+    
+    merged = stage('frt_merge', frt_merge)
+    frames = {'buildings': merged['buildings']}
+    frames['points_inside'] = lists_to_points(merged['points_inside'].points_inside, vocabulary)
+    frames['points_vocabulary'] = vocabulary
+    if last_stage == 'dataset':
+        frames['districts'] = stage('dataset', dataset)['districts']
+    
+    return frames
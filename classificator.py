@@ -1,78 +1,115 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from model_registry import ModelRegistry, registry
+from schema import apply_schema
+
+# Операции, из которых составляются условия правил: (колонка, операция, значение)
+RULE_OPERATIONS = {
+    'notna': lambda column, value: column.notna(),
+    'eq': lambda column, value: column == value,
+    'notin': lambda column, value: ~column.isin(value),
+    'gt': lambda column, value: pd.to_numeric(column, errors = 'coerce') > value
+}
+
+# Правила классификации зданий, применяются по порядку (следующее правило перезаписывает предыдущие)
+# value - новое значение, value_from - колонка, из которой берется значение, how - объединение условий (all/any)
+BUILDING_RULES = [
+    #определение здания по landuse, а при наличии amenity - по amenity
+    {'target': 'building', 'value_from': 'landuse',
+     'when': [('landuse', 'notna', None), ('landuse', 'notin', ['non-residential', 'residential', 'allotments'])]},
+    {'target': 'building', 'value_from': 'amenity', 'when': [('amenity', 'notna', None)]},
+    #определение частных домов
+    {'target': 'building', 'value': 'house', 'how': 'any',
+     'when': [('landuse', 'eq', 'rural'), ('building', 'eq', 'detached')]},
+    #многоэтажный дом, если указано количество квартир или жилая площадь
+    {'target': 'building', 'value': 'apartments', 'how': 'any',
+     'when': [('building:flats', 'gt', 0), ('area_residential', 'gt', 0)]}
+]
+
+# Правила для жилых зданий (only_people)
+PEOPLE_RULES = [
+    {'target': 'residential', 'value': 'urban', 'when': [('residential', 'eq', 'apartments')]},
+    {'target': 'residential', 'value': 'rural', 'when': [('residential', 'eq', 'gated')]},
+    {'target': 'landuse', 'value_from': 'residential', 'when': [('residential', 'notna', None)]}
+]
+
+# Функция, применяющая таблицу правил к датафрейму через булевы маски по колонкам
+def apply_rules(df: pd.DataFrame, rules: list) -> pd.DataFrame:
+    
+    for rule in rules:
+        # у nullable-колонок схемы сравнение с пропуском дает pd.NA, такие строки под условие не попадают
+        masks = [RULE_OPERATIONS[operation](df[column], value).fillna(False).to_numpy(bool)
+                 for column, operation, value in rule['when']]
+        if rule.get('how', 'all') == 'any':
+            mask = np.logical_or.reduce(masks)
+        else:
+            mask = np.logical_and.reduce(masks)
+        
+        value = df[rule['value_from']].astype(object) if 'value_from' in rule else rule['value']
+        # в категориальную колонку нельзя записать значение не из словаря, правило применяется к object
+        df[rule['target']] = df[rule['target']].astype(object).mask(mask, value)
+        
+    return df
+
 # Функция для классификации зданий
 def classify_buildings(df: gpd.GeoDataFrame, only_people: bool) -> gpd.GeoDataFrame:
-       
-    #определение здания по amenity и landuse
-    df['building'] = df.apply(
-        lambda row: 
-        row['amenity'] if not check_nan(row['amenity']) 
-        else row['landuse'] if not check_nan(row['landuse']) 
-        and row['landuse'] not in ['non-residential', 'residential', 'allotments']
-        else row['building'], axis = 1 
-    )
-    
-    #определение частных домов
-    df['building'] = df.apply(
-        lambda row: 
-        'house' if row['landuse'] == 'rural' or row['building'] == 'detached'
-        else row['building'], axis = 1
-    )
     
-    #многоэтажный дом, если указано количество квартир или жилая площадь
-    df['building'] = df.apply(
-        lambda row: 'apartments' 
-        if not check_nan(row['building:flats']) and row['building:flats'] > 0 
-        or not check_nan(row['area_residential']) and row['area_residential'] > 0
-        else row['building'], axis = 1
-    )
+    df = apply_rules(df, BUILDING_RULES)
      
     residential = ['house', 'detached', 'apartments', 'residential', 'dormitory', 'yes']
     
     if only_people:
-        df = df[df.building.isin(residential)]
-        df.residential = df.residential.apply(
-            lambda x: 'urban' if x in ['apartments'] else 'rural' if x in ['gated'] else x
-        )
-        df.landuse = df.apply(
-            lambda row: row['residential'] if not check_nan(row['residential'])
-            else row['landuse'] if row['landuse'] == 'residential'
-            else row['landuse'], axis = 1
-        )
+        df = df[df.building.isin(residential)].copy()
+        df = apply_rules(df, PEOPLE_RULES)
     
-    return df
+    return apply_schema(df)
 
-# Функция для классификации землепользования (ML)
-def classify_landuse(districts: gpd.GeoDataFrame, main_df: gpd.GeoDataFrame, dataset_path: str, model_path: str) -> gpd.GeoDataFrame:
-    
-    ds_features = pd.read_csv(f'./{dataset_path}', sep =';')
-    ds_features.landuse_people = ds_features.landuse_people.astype('category')
-    ds_features['landuse_code'] = ds_features.landuse_people.cat.codes
-    landuse_codes = {code : value for code, value in zip(ds_features.landuse_code, ds_features.landuse_people)}
-    
-    cols = ['median_levels', 'median_footprint_square', 'apartments_rate',
-            'schools', 'kindergartens', 'playgrounds', 'parkings', 'building_density']
+# Признаки районов для модели землепользования
+LANDUSE_FEATURES = ['median_levels', 'median_footprint_square', 'apartments_rate',
+                    'schools', 'kindergartens', 'playgrounds', 'parkings', 'building_density']
+
+# Функция, возвращающая ключ районов: транспортные районы - district_id, районы землепользования - тип и id OSM
+def district_index(districts: pd.DataFrame) -> list:
+    return ['district_id'] if 'district_id' in districts.columns else ['element_type_landuse', 'osmid_landuse']
+
+# Функция для переноса предсказаний районов на здания: здания без landuse получают класс своего района
+def apply_landuse_predictions(main_df: gpd.GeoDataFrame, districts: pd.DataFrame, pred: np.ndarray) -> gpd.GeoDataFrame:
     
-    if 'district_id' in districts.columns:
-        index = ['district_id']
-    else:
-        index = ['element_type_landuse', 'osmid_landuse'] 
+    index = district_index(districts)
+    suffix = 'transport' if index == ['district_id'] else 'landuse'
     
-    cols += index
-    districts = districts[cols]
+    predictions = pd.Series(pred, index = pd.MultiIndex.from_frame(districts[index].astype(object)), dtype = object)
+    predictions = predictions[~predictions.index.duplicated()]
+    main_df = main_df.copy()
+    main_df[f'predicted_landuse_{suffix}'] = predictions.reindex(
+        pd.MultiIndex.from_frame(main_df[index].astype(object))).values
+    main_df['landuse'] = main_df['landuse'].astype(object).fillna(main_df[f'predicted_landuse_{suffix}'])
     
-    model = CatBoostClassifier()
-    model.load_model(f'./{model_path}', format = 'cbm')
-    pred = model.predict(districts.drop(columns = index))
-    pred = pred.flatten()
+    return apply_schema(main_df)
+
+# Функция для классификации землепользования (ML)
+# Модель и классы берутся из реестра (загружаются один раз), dataset_path нужен только для моделей без метаданных
+def classify_landuse(districts: gpd.GeoDataFrame, main_df: gpd.GeoDataFrame, dataset_path: str, model_path: str,
+                     registry: ModelRegistry = registry) -> gpd.GeoDataFrame:
     
-    suffix = 'transport' if 'district_id' in districts.columns else 'landuse'
-    districts[f'predicted_landuse_{suffix}'] = [landuse_codes[i] for i in pred]
+    features = districts[LANDUSE_FEATURES].astype('float64')
+    pred = registry.predict(model_path, features, dataset_path = dataset_path)
     
-    main_df = main_df.merge(districts[index + [f'predicted_landuse_{suffix}']], how = 'left')
+    return apply_landuse_predictions(main_df, districts, pred)
+
+# Функция для классификации землепользования сразу для нескольких городов: {город: (районы, здания)}
+# Районы всех городов предсказываются одним вызовом модели, результат раскладывается по городам
+def classify_landuse_many(places: dict, dataset_path: str, model_path: str,
+                          registry: ModelRegistry = registry) -> dict:
     
-    main_df.landuse = main_df.apply(
-        lambda row: row[f'predicted_landuse_{suffix}'] if check_nan(row['landuse']) else row['landuse'], axis = 1)
+    names = list(places.keys())
+    features = pd.concat([places[name][0][LANDUSE_FEATURES].astype('float64') for name in names], ignore_index = True)
+    pred = registry.predict(model_path, features, dataset_path = dataset_path)
     
-    return main_df
+    bounds = np.cumsum([0] + [len(places[name][0]) for name in names])
+    return {name: apply_landuse_predictions(places[name][1], places[name][0], pred[bounds[i]:bounds[i + 1]])
+            for i, name in enumerate(names)}
 
 
 
@@ -1,56 +1,127 @@
 import osmnx as ox
 import os
+import shutil
+import hashlib
+import json
+import time
+import threading
+import numpy as np
+import shapely
 import geopandas as gpd
 import requests
-from shapely.geometry import Polygon, Point, MultiPolygon
+from shapely.geometry import Polygon, Point, MultiPolygon, shape
 import pandas as pd
-from shapely import wkt, polygonize
+from shapely import wkt, polygonize, STRtree
 from typing import Union
 from shapely.validation import make_valid
+from osmnx._errors import InsufficientResponseError
+from geometry import make_grid, count_square, polygonal_part
+from osm_extract import prepare_extract
+from preprocessor import modify_dataframes, points_inside_building, join_districts_parkings_playgrounds, TagVocabulary, points_to_lists
+from dataclasses import dataclass, field
+from scipy import sparse
+from schema import apply_schema
 
 
+# Адрес Nominatim (можно заменить на локальный сервер) и папка для кэша ответов
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_CACHE = 'nominatim_cache'
+
+# Общая HTTP-сессия и минимальный интервал между запросами к Nominatim (не чаще 1 запроса в секунду)
+session = requests.Session()
+session.headers.update({'User-agent': 'Firefox/47.0'})
+nominatim_interval = 1.0
+nominatim_lock = threading.Lock()
+last_request_time = 0.0
+
 # Функция для получения полигонов по названию
-def get_polygons(location_name: str) -> dict:
+# Ответы Nominatim сохраняются на диск по запросу, повторный запрос того же места читается из кэша
+def get_polygons(location_name: str, base_url: str = None, cache_folder: str = None) -> dict:
+    
+    global last_request_time
+    base_url = base_url or NOMINATIM_URL
+    cache_folder = cache_folder or NOMINATIM_CACHE
+    
+    key = hashlib.sha1(f'{base_url}|{location_name}'.encode()).hexdigest()
+    cache_path = os.path.join(cache_folder, f'{key}.json')
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding = 'utf-8') as file:
+            return json.load(file)
     
-    base_url = "https://nominatim.openstreetmap.org/search"
-    headers = {'User-agent': 'Firefox/47.0'}
     params = {
         "q": location_name,
         "format": "json",
         "polygon_geojson": 1
     }
-
-    response = requests.get(base_url, headers = headers, params=params)
+    
+    with nominatim_lock:
+        wait = nominatim_interval - (time.monotonic() - last_request_time)
+        if wait > 0:
+            time.sleep(wait)
+        response = session.get(base_url, params = params, timeout = 60)
+        last_request_time = time.monotonic()
     print(f'status code: {response.status_code}')
     
-    return response.json() if response.status_code == 200 else {}
+    if response.status_code != 200:
+        return {}
+    
+    os.makedirs(cache_folder, exist_ok = True)
+    with open(cache_path, 'w', encoding = 'utf-8') as file:
+        json.dump(response.json(), file, ensure_ascii = False)
+    
+    return response.json()
 
-# Получение списка полигонов по вхродным координатам
-def make_place_geometry(place_input: Union[str, list, tuple, Polygon, MultiPolygon]) -> Polygon:
+# Функция для выбора полигона из ответа Nominatim без участия пользователя
+# Порядок предпочтения: объект в России, административная граница, наибольшая площадь
+def select_place_polygon(polygon_list: list) -> Union[Polygon, MultiPolygon, None]:
+    
+    candidates = [item for item in polygon_list if item['geojson']['type'] in ['Polygon', 'MultiPolygon']]
+    if len(candidates) == 0:
+        return None
+    
+    def priority(item):
+        return ('Россия' in item['display_name'],
+                item.get('class') == 'boundary' and item.get('type') == 'administrative',
+                shape(item['geojson']).area)
+    
+    return shape(max(candidates, key = priority)['geojson'])
 
-    if isinstance(place_input, str):
-        polygon_list = get_polygons(place_input)
+# Функция для интерактивного выбора полигона из ответа Nominatim
+def choose_place_polygon(polygon_list: list) -> Union[Polygon, MultiPolygon, None]:
+    
+    for i, item in enumerate(polygon_list):
+        name = item['display_name']
+        place_type = item['geojson']['type']
+        if 'Россия' in item['display_name']:
+            print(f'{i} ({place_type}) {name}')
 
-        for i, item in enumerate(polygon_list):
-            name = item['display_name']
-            place_type = item['geojson']['type']
-            if 'Россия' in item['display_name']:
-                print(f'{i} ({place_type}) {name}')
+    num = int(input())
 
-        num = int(input())
+    place_type = polygon_list[num]['geojson']['type']
+    place_coords = polygon_list[num]['geojson']['coordinates']
 
-        place_type = polygon_list[num]['geojson']['type']
-        place_coords = polygon_list[num]['geojson']['coordinates']
+    if place_type == 'MultiPolygon':
+        polygons = [Polygon(place_coords[i][0]) for i in range(0, len(place_coords))]
+        return MultiPolygon(polygons)
+    elif place_type == 'Polygon':
+        return Polygon(place_coords[0])
+    
+    return None
 
-        if place_type == 'MultiPolygon':
-            polygons = [Polygon(place_coords[i][0]) for i in range(0, len(place_coords))]
-            place_geometry = MultiPolygon(polygons)
-                   
-        elif place_type == 'Polygon':
-            place_geometry = Polygon(place_coords[0])
-                   
+# Получение списка полигонов по вхродным координатам
+# По умолчанию полигон по названию выбирается автоматически (select_place_polygon), interactive - выбор пользователем
+def make_place_geometry(place_input: Union[str, list, tuple, Polygon, MultiPolygon], interactive: bool = False) -> Polygon:
+
+    if isinstance(place_input, str):
+        polygon_list = get_polygons(place_input)
+        
+        if interactive:
+            place_geometry = choose_place_polygon(polygon_list)
         else:
-            print(f'Населенный пункт {place_input} не представлен в виде полигона')
+            place_geometry = select_place_polygon(polygon_list)
+            
+        if place_geometry is None:
+            raise ValueError(f'Населенный пункт {place_input} не представлен в виде полигона')
             
     if isinstance(place_input, list):
         #north, south, west, east
@@ -70,25 +141,94 @@ def make_place_geometry(place_input: Union[str, list, tuple, Polygon, MultiPolyg
     
     return place_geometry
 
-# Основная функция для получения данных из OSM
-def enrich_data(input_polygon: Union[Polygon, MultiPolygon, str], verbose: bool, only_people: bool, cache: bool) -> pd.DataFrame:
+# Функция для получения полигонов по списку названий (без участия пользователя)
+# Возвращает словарь {название: полигон}, ненайденные места выводятся и пропускаются
+def make_place_geometries(places: list) -> dict:
     
-    ox.settings.use_cache = cache
-    global dataframes
-    global transport_districts
-    global landuse_districts
+    geometries = {}
+    for place_name in places:
+        try:
+            geometries[place_name] = make_place_geometry(place_name)
+        except ValueError as e:
+            print(e)
+            
+    return geometries
+
+# Контекст одного запуска enrich_data: слои OSM и промежуточные результаты (вместо глобальных переменных модуля),
+# благодаря ему несколько городов можно обрабатывать одновременно в потоках одного процесса
+@dataclass
+class PipelineContext:
+    place_name: str = None
+    dataframes: dict = field(default_factory = dict)
+    buildings: gpd.GeoDataFrame = None
+    landuse_districts: gpd.GeoDataFrame = None
+    transport_districts: gpd.GeoDataFrame = None
+    extract_path: str = None
+    # теги точек внутри зданий: строки матрицы - колонка points_row зданий, словарь можно разделять между городами
+    points_inside: sparse.csr_matrix = None
+    points_vocabulary: TagVocabulary = field(default_factory = TagVocabulary)
+
+# Функция для получения транспортных районов с признаками (парковки, площадки, школы, сады, площадь)
+def get_transport_districts_features(polygon: Union[Polygon, MultiPolygon], dataframes: dict,
+                                     extract_path: str = None) -> gpd.GeoDataFrame:
     
-    dataframes = {}
-    transport_districts = None
+    districts = make_transport_districts(polygon, extract_path = extract_path)
+    districts = join_districts_parkings_playgrounds(districts, 'district_id', dataframes)
+    districts = count_square(districts).rename(columns = {'geometry_square': 'district_square_km2'})
+    districts.district_square_km2 = (districts.district_square_km2 / (10 ** 6)).round(2)
     
-    tags = ['building', 'amenity', 'landuse', 'shop', 'craft', 'emergency', 
+    return districts
+
+# Теги OSM, по которым собираются слои для полигона
+OSM_TAGS = ['building', 'amenity', 'landuse', 'shop', 'craft', 'emergency', 
             'leisure', 'office', 'industrial', 'tourism']
+
+# Функция для разбиения общего ответа по всем тегам на датафреймы по тегам (как при отдельных запросах для каждого тега)
+def split_layers(features: gpd.GeoDataFrame, tags: list, verbose: bool) -> dict:
     
-    if type(input_polygon) == str:
-        input_polygon = wkt.loads(input_polygon)
-    if not input_polygon.is_valid:
-        input_polygon = make_valid(input_polygon)
+    dataframes = {}
+    for tag in tags:
+        if tag not in features.columns:
+            if verbose:
+                print(f'{tag} unsuccessful')
+            continue
+        # пустые колонки остаются только от других тегов, при отдельном запросе их бы не было
+        dataframes[tag] = features[features[tag].notna()].dropna(axis = 1, how = 'all')
+        if verbose:
+            print(f'{tag} successful')
+            
+    return dataframes
+
+# Функция для получения всех слоев OSM одним запросом к Overpass
+def fetch_layers_single_query(input_polygon: Union[Polygon, MultiPolygon], tags: list, verbose: bool) -> dict:
+    
+    try:
+        features = ox.features_from_polygon(input_polygon, {tag: True for tag in tags})
+    except InsufficientResponseError as e:
+        if verbose:
+            print('single query unsuccessful')
+        return {}
     
+    return split_layers(features, tags, verbose)
+
+# Функция для получения всех слоев OSM из локальной выгрузки (.osm/.osm.bz2/.pbf) вместо Overpass
+# Из выгрузки потоково вырезается охват полигона, дальше osmnx строит слои той же структуры, что и из Overpass
+def fetch_layers_from_extract(extract_path: str, input_polygon: Union[Polygon, MultiPolygon], tags: list, verbose: bool) -> dict:
+    
+    try:
+        features = ox.features_from_xml(prepare_extract(extract_path, input_polygon), polygon = input_polygon,
+                                        tags = {tag: True for tag in tags})
+    except InsufficientResponseError as e:
+        if verbose:
+            print('extract unsuccessful')
+        return {}
+    
+    return split_layers(features, tags, verbose)
+
+# Функция для получения слоев OSM отдельным запросом для каждого тега
+def fetch_layers_per_tag(input_polygon: Union[Polygon, MultiPolygon], tags: list, verbose: bool) -> dict:
+    
+    dataframes = {}
     for tag in tags:
         try:
             dataframes[f'{tag}'] = ox.features_from_polygon(input_polygon, {tag: True})
@@ -98,24 +238,89 @@ def enrich_data(input_polygon: Union[Polygon, MultiPolygon, str], verbose: bool,
             if verbose:
                 print(f'{tag} unsuccessful')
             continue
+            
+    return dataframes
+
+# Основная функция для получения данных из OSM
+# single_query - все теги одним запросом к Overpass, overpass_endpoint - адрес другого сервера Overpass (например, локального)
+def enrich_data(input_polygon: Union[Polygon, MultiPolygon, str], verbose: bool, only_people: bool, cache: bool,
+                single_query: bool = True, overpass_endpoint: str = None, context: PipelineContext = None,
+                extract_path: str = None) -> pd.DataFrame:
+    
+    ox.settings.use_cache = cache
+    if context is None:
+        context = PipelineContext()
+    
+    tags = OSM_TAGS
+    
+    if type(input_polygon) == str:
+        input_polygon = wkt.loads(input_polygon)
+    if not input_polygon.is_valid:
+        input_polygon = make_valid(input_polygon)
+    
+    # адрес Overpass - общая настройка osmnx, другой сервер задается только на время этого вызова
+    previous_endpoint = ox.settings.overpass_url
+    if overpass_endpoint is not None:
+        ox.settings.overpass_url = overpass_endpoint
+    try:
+        context.extract_path = extract_path
+        if extract_path is not None:
+            dataframes = fetch_layers_from_extract(extract_path, input_polygon, tags, verbose)
+        elif single_query:
+            dataframes = fetch_layers_single_query(input_polygon, tags, verbose)
+        else:
+            dataframes = fetch_layers_per_tag(input_polygon, tags, verbose)
+        
+        return enrich_layers(dataframes, input_polygon, only_people, context)
+    finally:
+        ox.settings.overpass_url = previous_endpoint
+
+# Колонки слоев, без которых не обходится обработка: в маленькой области (тайл, область пересчета изменений)
+# какого-то из слоев может не быть, тогда он заменяется пустым
+REQUIRED_LAYERS = {
+    'building': ['element_type', 'osmid', 'building', 'geometry'],
+    'landuse': ['element_type', 'osmid', 'geometry', 'landuse', 'residential'],
+    'amenity': ['geometry', 'amenity'],
+    'parkings': ['geometry'],
+    'playgrounds': ['geometry']
+}
+
+# Функция, добавляющая пустые слои вместо отсутствующих
+def add_missing_layers(dataframes: dict) -> dict:
+    
+    for name, columns in REQUIRED_LAYERS.items():
+        if name not in dataframes:
+            dataframes[name] = gpd.GeoDataFrame(columns = columns, geometry = 'geometry', crs = 'EPSG:4326')
+    
+    return dataframes
+
+# Функция для обработки загруженных слоев OSM: предподготовка зданий, признаки районов, пространственные соединения
+def enrich_layers(dataframes: dict, input_polygon: Union[Polygon, MultiPolygon], only_people: bool,
+                  context: PipelineContext = None) -> pd.DataFrame:
+    
+    if context is None:
+        context = PipelineContext()
     
     dataframes = {k: v for k, v in dataframes.items() if len(v) > 0}
     
     cols = ['element_type', 'osmid', 'building', 'geometry', 'footprint_square',
             'addr:street', 'addr:housenumber', 'building:levels', 'building:flats']
     
-    dataframes = modify_dataframes(dataframes, cols)
+    dataframes = add_missing_layers(modify_dataframes(dataframes, cols))
     main_df = dataframes['building']
     main_df = count_square(main_df).rename(columns = {'geometry_square': 'footprint_square'})
     
-    landuse_districts = join_districts_parkings_playgrounds(dataframes['landuse'], ['element_type', 'osmid'])
+    landuse_districts = join_districts_parkings_playgrounds(dataframes['landuse'], ['element_type', 'osmid'], dataframes)
     landuse_districts = count_square(landuse_districts).rename(columns = {'geometry_square': 'district_square_km2'})
     landuse_districts.district_square_km2 = landuse_districts.district_square_km2.apply(lambda x: round(x / (10 ** 6), 2))
     
-    transport_districts = get_transport_districts_features(input_polygon)
+    # заранее заданные в контексте транспортные районы не строятся заново (например, при пересчете изменений)
+    transport_districts = context.transport_districts
+    if transport_districts is None:
+        transport_districts = get_transport_districts_features(input_polygon, dataframes, context.extract_path)
     main_df = main_df.sjoin(dataframes['amenity'], how='left').drop(columns=['index_right'])
     cols += ['amenity']
-    main_df = points_inside_building(dataframes, main_df, cols)    
+    main_df, context.points_inside = points_inside_building(dataframes, main_df, cols, vocabulary = context.points_vocabulary)
      
     residential = ['house', 'detached', 'apartments', 'residential', 'dormitory', 'terrace', 'yes']
     if only_people:
@@ -128,14 +333,163 @@ def enrich_data(input_polygon: Union[Polygon, MultiPolygon, str], verbose: bool,
     main_df = main_df.sjoin(transport_districts[['geometry', 'district_id']], how = 'left').drop(columns = ['index_right'])
     landuse_districts.rename(columns = {'element_type': 'element_type_landuse', 'osmid': 'osmid_landuse'}, inplace = True)
     
+    # типы колонок фиксируются схемой сразу после сбора, дальше все этапы их сохраняют
+    main_df = apply_schema(main_df)
+    
+    context.dataframes = dataframes
+    context.landuse_districts = apply_schema(landuse_districts)
+    context.transport_districts = apply_schema(transport_districts)
+    context.buildings = main_df
+    
     return main_df
 
+# Функция для сбора данных по большому полигону (область) по тайлам с записью результата на диск
+# Каждое здание относится к тайлу, в котором лежит его representative_point, и записывается один раз по osmid,
+# поэтому пиковая память зависит от размера тайла, а не от размера региона
+# Тайлы сначала пишутся во временные части, итоговый csv собирается с объединением колонок всех тайлов
+# extract_path - локальная выгрузка OSM: охват региона вырезается из нее один раз, тайлы вырезаются уже из этого фрагмента
+def enrich_data_tiled(input_polygon: Union[Polygon, MultiPolygon, str], output_path: str, tile_size_km: float,
+                      verbose: bool, only_people: bool, cache: bool, extract_path: str = None) -> str:
+    
+    if type(input_polygon) == str:
+        input_polygon = wkt.loads(input_polygon)
+    if not input_polygon.is_valid:
+        input_polygon = make_valid(input_polygon)
+    if extract_path is not None:
+        extract_path = prepare_extract(extract_path, input_polygon)
+    
+    tiles = make_grid(input_polygon, tile_size_km)
+    seen_buildings = set()
+    columns = []
+    parts_folder = f'{output_path}.parts'
+    shutil.rmtree(parts_folder, ignore_errors = True)
+    os.makedirs(parts_folder)
+    parts = []
+    
+    for tile_id, tile in enumerate(tiles):
+        # на стыке с границей пересечение может выродиться в линию или точку
+        tile_polygon = polygonal_part(make_valid(tile.intersection(input_polygon)))
+        if tile_polygon is None:
+            if verbose:
+                print(f'[{tile_id + 1}/{len(tiles)}] тайл пропущен: пересечение с полигоном не площадное')
+            continue
+        
+        context = PipelineContext()
+        try:
+            tile_df = enrich_data(tile_polygon, verbose = False, only_people = only_people, cache = cache, context = context,
+                                  extract_path = extract_path)
+        except (KeyError, InsufficientResponseError, ValueError) as e:
+            if verbose:
+                print(f'[{tile_id + 1}/{len(tiles)}] тайл пропущен: {type(e).__name__} {e}')
+            continue
+        
+        # здания на границе попадают в несколько тайлов, оставляем их в тайле с representative_point
+        points = tile_df.geometry.representative_point()
+        owned = points.intersects(tile) | ~points.intersects(input_polygon)
+        keys = list(zip(tile_df.element_type, tile_df.osmid))
+        new = [key not in seen_buildings for key in keys]
+        tile_df = tile_df[owned & pd.Series(new, index = tile_df.index)]
+        seen_buildings.update(zip(tile_df.element_type, tile_df.osmid))
+        if len(tile_df) == 0:
+            continue
+        
+        # district_id транспортных районов уникален только внутри тайла
+        tile_df['tile_id'] = tile_id
+        tile_df['points_inside'] = points_to_lists(context.points_inside, context.points_vocabulary, tile_df.points_row)
+        tile_df = tile_df.drop(columns = ['points_row'])
+        columns += [column for column in tile_df.columns if column not in columns]
+        parts.append(os.path.join(parts_folder, f'{tile_id:06d}.csv'))
+        tile_df.to_csv(parts[-1], sep = ';', index = False)
+        
+        if verbose:
+            print(f'[{tile_id + 1}/{len(tiles)}] записано зданий: {len(tile_df)}')
+        del tile_df
+    
+    # части читаются по одной как текст, недостающие колонки тайла остаются пустыми
+    pd.DataFrame(columns = columns).to_csv(output_path, sep = ';', index = False)
+    for part in parts:
+        part_df = pd.read_csv(part, sep = ';', dtype = str, keep_default_na = False)
+        part_df.reindex(columns = columns, fill_value = '').to_csv(output_path, sep = ';', index = False, mode = 'a', header = False)
+    shutil.rmtree(parts_folder)
+    
+    return output_path
+
+# Типы населенных пунктов, полигоны которых попадают в локальный индекс границ
+PLACE_TYPES = ['city', 'town', 'village', 'hamlet']
+
+# Кэш загруженных индексов границ (путь к файлу -> индекс)
+admin_indexes = {}
+
+# Функция, приводящая название города/региона к виду из ФРТ (без кавычек, слов со строчной буквы и лишних слов)
+def normalize_place_name(name: str, extra_word: str) -> str:
+    
+    if name != None and ' ' in name:
+        name = name.split(' ')
+        name = [word.replace('«', '').replace('»', '') for word in name]
+        name = ' '.join([word for word in name if word[:1].isupper() and word != extra_word])
+        
+    return name
+
+# Функция для однократной выгрузки границ регионов (admin_level=4) и населенных пунктов в локальный файл
+def build_admin_boundaries(polygon: Union[Polygon, MultiPolygon], path: str) -> str:
+    
+    features = ox.features_from_polygon(polygon, {'admin_level': '4', 'place': PLACE_TYPES}).reset_index()
+    features = features[features.geometry.geom_type.isin(['Polygon', 'MultiPolygon']) & features['name'].notna()]
+    
+    regions = features[features['admin_level'] == '4'] if 'admin_level' in features.columns else features.iloc[:0]
+    cities = features[features['place'].isin(PLACE_TYPES)] if 'place' in features.columns else features.iloc[:0]
+    boundaries = pd.concat([
+        gpd.GeoDataFrame({'name': regions['name'].values, 'kind': 'region'}, geometry = regions.geometry.values, crs = 'EPSG:4326'),
+        gpd.GeoDataFrame({'name': cities['name'].values, 'kind': 'city'}, geometry = cities.geometry.values, crs = 'EPSG:4326')
+    ], ignore_index = True)
+    
+    boundaries.to_parquet(path)
+    return path
+
+# Функция для загрузки индекса границ (STRtree регионов и городов), загружается один раз на файл
+def load_admin_index(path: str) -> dict:
+    
+    if path not in admin_indexes:
+        boundaries = gpd.read_parquet(path)
+        index = {}
+        for kind in ['region', 'city']:
+            part = boundaries[boundaries.kind == kind]
+            geometries = np.asarray(part.geometry.values, dtype = object)
+            # при вложенных полигонах выбирается наименьший
+            index[kind] = (STRtree(geometries), part['name'].values, shapely.area(geometries))
+        admin_indexes[path] = index
+        
+    return admin_indexes[path]
+
+# Функция для определения городов и регионов по списку точек через локальный индекс границ
+def lookup_city_and_region(points: list, admin_index: dict) -> list:
+    
+    points = np.asarray(points, dtype = object)
+    found = {}
+    for kind in ['region', 'city']:
+        tree, names, areas = admin_index[kind]
+        point_index, polygon_index = tree.query(points, predicate = 'within')
+        order = np.lexsort((areas[polygon_index], point_index))
+        point_index, polygon_index = point_index[order], polygon_index[order]
+        first = np.unique(point_index, return_index = True)[1]
+        found[kind] = dict(zip(point_index[first], names[polygon_index[first]]))
+    
+    return [(normalize_place_name(found['city'].get(i), "Городской"), normalize_place_name(found['region'].get(i), "Республика"))
+            for i in range(len(points))]
+
 # Функция для получения города и региона по полигону
-def get_city_and_region_from_polygon(polygon: Union[Polygon, MultiPolygon]) -> tuple:
+# Если передан файл границ (build_admin_boundaries), запрос к Overpass выполняется, только если города или региона нет в файле
+def get_city_and_region_from_polygon(polygon: Union[Polygon, MultiPolygon], boundaries: str = None) -> tuple:
+    
+    if boundaries is not None and os.path.exists(boundaries):
+        city, region = lookup_city_and_region([polygon.centroid], load_admin_index(boundaries))[0]
+        # город добавлен после построения файла границ
+        if city is not None and region is not None:
+            return (city, region)
     
     city, region = None, None
     c = polygon.centroid
-    r = requests.get(f'https://overpass-api.de/api/interpreter?data=[out:json];%20is_in({c.y},%20{c.x});%20out;').json()
+    r = requests.get(f'https://overpass-api.de/api/interpreter?data=[out:json];%20is_in({c.y},%20{c.x});%20out;', timeout = 60).json()
 
     for elem in r['elements']:
         if elem['type'] == 'area' and 'admin_level' in elem['tags'].keys():
@@ -144,15 +498,8 @@ def get_city_and_region_from_polygon(polygon: Union[Polygon, MultiPolygon]) -> t
         elif elem['type'] == 'area' and 'place' in elem['tags'].keys():
             city = elem['tags']['name']    
     
-    if city != None and ' ' in city:
-        city = city.split(' ')
-        city = [word.replace('«', '').replace('»', '') for word in city]
-        city = ' '.join([word for word in city if word[0].isupper() and word != "Городской"])
-        
-    if region != None and ' ' in region:
-        region = region.split(' ')
-        region = [word.replace('«', '').replace('»', '') for word in region]
-        region = ' '.join([word for word in region if word[0].isupper() and word != "Республика"])
+    city = normalize_place_name(city, "Городской")
+    region = normalize_place_name(region, "Республика")
 
     return (city, region)
 
@@ -172,28 +519,68 @@ def get_city_and_region_from_polygon(polygon: Union[Polygon, MultiPolygon]) -> t
     frt_data = frt_data.rename(columns = changes)
     return frt_data
 
+# Классы дорог, по которым город разбивается на транспортные районы
+MAIN_ROADS = ['primary', 'secondary', 'tertiary', 'residential', 'unclassified']
+
+# Функция для получения источника данных OSM для ключей кэша: путь к локальной выгрузке или адрес сервера Overpass
+def data_source_key(extract_path: str = None) -> str:
+    if extract_path is not None:
+        return f'extract:{os.path.abspath(extract_path)}'
+    return f'overpass:{ox.settings.overpass_url}'
+
+# Функция для получения ключа кэша транспортных районов по полигону, классам дорог и источнику данных
+def transport_districts_cache_key(polygon: Union[Polygon, MultiPolygon], roads: list, source: str) -> str:
+    key = hashlib.sha1(shapely.to_wkb(shapely.normalize(polygon)))
+    key.update('|'.join(sorted(roads)).encode())
+    key.update(source.encode())
+    return key.hexdigest()
+
 # Функция для разбиения города на транспортные районы
-def make_transport_districts(polygon: Polygon) -> gpd.GeoDataFrame:
+# Загружаются только нужные классы дорог, результат кэшируется на диске по хэшу полигона и источника данных
+# extract_path - локальная выгрузка OSM вместо Overpass
+def make_transport_districts(polygon: Polygon, cache_folder: str = 'transport_districts_cache', use_cache: bool = True,
+                             extract_path: str = None) -> gpd.GeoDataFrame:
+    
+    cache_key = transport_districts_cache_key(polygon, MAIN_ROADS, data_source_key(extract_path))
+    cache_path = os.path.join(cache_folder, f'{cache_key}.parquet')
+    if use_cache and os.path.exists(cache_path):
+        return gpd.read_parquet(cache_path)
+    
+    try:
+        if extract_path is not None:
+            graph = ox.graph_from_xml(prepare_extract(extract_path, polygon), retain_all = True)
+            graph = ox.truncate.truncate_graph_polygon(graph, polygon, retain_all = True)
+            edges = ox.graph_to_gdfs(graph, nodes=False, edges=True).reset_index()
+            # во фрагменте может не быть ни одной дороги (только здания и другие линии)
+            if 'highway' not in edges.columns:
+                edges = edges.iloc[:0]
+            else:
+                edges = edges[edges.highway.explode().isin(MAIN_ROADS).groupby(level = 0).any()]
+        else:
+            roads_filter = f'["highway"~"^({"|".join(MAIN_ROADS)})$"]'
+            graph = ox.graph_from_polygon(polygon, custom_filter = roads_filter, retain_all = True)
+            edges = ox.graph_to_gdfs(graph, nodes=False, edges=True).reset_index()
+    except (InsufficientResponseError, ValueError):
+        edges = []
+    
+    # в полигоне нет главных дорог - районов нет, пустой результат не кэшируется
+    if len(edges) == 0:
+        return gpd.GeoDataFrame(columns = ['geometry', 'district_id'], geometry = 'geometry', crs = 'EPSG:4326')
     
-    graph = ox.graph_from_polygon(polygon, network_type='all')
-    edges = ox.graph_to_gdfs(graph, nodes=False, edges=True)
+    # в графе каждая двусторонняя дорога представлена двумя ребрами (u, v) и (v, u)
+    edges['u_min'] = edges[['u', 'v']].min(axis = 1)
+    edges['v_max'] = edges[['u', 'v']].max(axis = 1)
+    edges = edges.drop_duplicates(subset = ['u_min', 'v_max', 'key'])
     
-    edges = edges.explode('highway')
-    main_roads = ['primary', 'secondary', 'tertiary', 'residential', 'unclassified']
-    edges = edges[edges.highway.isin(main_roads)]
-    roads_geometry = edges.unary_union
-    decomposition = polygonize(roads_geometry.geoms)
+    roads_geometry = shapely.union_all(np.asarray(edges.geometry.values, dtype = object))
+    decomposition = polygonize(shapely.get_parts(roads_geometry))
     polygons = gpd.GeoDataFrame({'geometry': decomposition.geoms})
     polygons = polygons.set_crs('EPSG:4326')
     
     polygons['district_id'] = polygons.index
     
+    if use_cache:
+        os.makedirs(cache_folder, exist_ok = True)
+        polygons.to_parquet(cache_path)
+    
     return polygons
-
-
-
-
-
-
-
-
@@ -1,40 +1,101 @@
+import os
+import shapely
 import pandas as pd
-from collector import enrich_data, make_place_geometry, get_city_and_region_from_polygon
-from utils import choose_frt_file, modify_address_to_join, merge_osm_frt
-
-
-places = ['Екатеринбург', 'Пермь', 'Алапаевск', 'Верхняя Пышма', 'Нижний Тагил']
-for place in places:
-    print(f'Сбор данных: {place}')
-    tmp_place_geometry = make_place_geometry(place)
-    tmp_osm_data = enrich_data(tmp_place_geometry, only_people = False, verbose = True, cache = True)
-    current_city_region = get_city_and_region_from_polygon(tmp_place_geometry)
-    extra_data = choose_frt_file(current_city_region, 'frt_datasets')
-    tmp_osm_data = modify_address_to_join(tmp_osm_data)
-    tmp_osm_data = merge_osm_frt(df_osm = tmp_osm_data, df_frt = extra_data)
-    tmp_osm_data.to_csv(f'{place}.csv', sep = ';', index = False)
-
-
-
-def get_landuse_data(places: list) -> pd.DataFrame:
-    
-    full_districts_df = pd.DataFrame()
-    for place_name in places:
-        place_geometry = make_place_geometry(place_name)
-        print(f'Загрузка данных: {place_name}')
-        try:
-            tmp_data_osm = enrich_data(place_geometry, verbose = True, only_people = True, cache = True)
-        except KeyError as k:
-            continue
-        tmp_city_reg = get_city_and_region_from_polygon(place_geometry)
-        tmp_extra_data = choose_frt_file(tmp_city_reg, 'frt_datasets')
-        tmp_data_osm = modify_address_to_join(tmp_data_osm)
-        tmp_data_osm = merge_osm_frt(df_osm = tmp_data_osm, df_frt = tmp_extra_data)
-        tmp_data_osm['str_geom'] = [str(x) for x in tmp_data_osm.geometry]
-        tmp = extract_districts_features(tmp_data_osm, landuse_districts, ['element_type_landuse', 'osmid_landuse'])
-        tmp = tmp[~(tmp.residential.isnull()) | (tmp.landuse != 'residential')]
-        tmp.residential = tmp.residential.replace(
-            {'apartments' : 'urban', 'single_family' : 'rural', 'detached' : 'rural', 'gated' : 'rural'})
-        full_districts_df = pd.concat([full_districts_df, tmp])
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collector import make_place_geometries, build_admin_boundaries
+from utils import build_frt_store
+from checkpoints import run_place_checkpointed
+from dataset_io import write_dataset
+from preprocessor import points_to_lists
+
+FRT_FOLDER = 'frt_datasets'
+FRT_STORE = 'frt_store'
+ADMIN_BOUNDARIES = 'admin_boundaries.parquet'
+CHECKPOINTS = 'checkpoints'
+# Папка колоночного датасета зданий (один файл на город) и формат вывода ('parquet' или старый 'csv')
+DATASET_FOLDER = 'buildings_dataset'
+OUTPUT_FORMAT = 'parquet'
+
+
+# Функция для сбора датасета по одному городу (выполняется в отдельном процессе)
+# Этапы сохраняются в чекпоинты, повторный запуск продолжает с последнего сохраненного этапа
+def get_place_data(place_name: str, place_geometry) -> pd.DataFrame:
+    
+    frames = run_place_checkpointed(place_name, place_geometry, only_people = False, frt_folder = FRT_FOLDER,
+                                    frt_store = FRT_STORE, admin_boundaries = ADMIN_BOUNDARIES,
+                                    folder = CHECKPOINTS, last_stage = 'frt_merge')
+    # в файлах теги точек внутри зданий хранятся списками, матрица восстанавливается через lists_to_points
+    tmp_osm_data = frames['buildings']
+    tmp_osm_data['points_inside'] = points_to_lists(frames['points_inside'], frames['points_vocabulary'],
+                                                    tmp_osm_data.points_row)
+    tmp_osm_data = tmp_osm_data.drop(columns = ['points_row'])
+    if OUTPUT_FORMAT == 'csv':
+        tmp_osm_data.to_csv(f'{place_name}.csv', sep = ';', index = False)
+    else:
+        write_dataset(tmp_osm_data, DATASET_FOLDER, place_name)
+    
+    return tmp_osm_data
+
+# Функция для сбора признаков районов по одному городу (выполняется в отдельном процессе)
+def get_place_landuse_data(place_name: str, place_geometry) -> pd.DataFrame:
+    
+    tmp = run_place_checkpointed(place_name, place_geometry, only_people = True, frt_folder = FRT_FOLDER,
+                                 frt_store = FRT_STORE, admin_boundaries = ADMIN_BOUNDARIES,
+                                 folder = CHECKPOINTS)['districts']
+    tmp = tmp[~(tmp.residential.isnull()) | (tmp.landuse != 'residential')]
+    tmp.residential = tmp.residential.replace(
+        {'apartments' : 'urban', 'single_family' : 'rural', 'detached' : 'rural', 'gated' : 'rural'})
+    
+    return tmp
+
+# Функция для параллельной обработки городов: один город - один процесс
+# Полигоны получаются заранее в основном процессе (общая сессия Nominatim с ограничением частоты запросов),
+# ошибка в одном городе не останавливает остальные, результаты объединяются один раз в конце
+def process_places_parallel(places: list, place_function, max_workers: int = None) -> tuple:
+    
+    geometries = make_place_geometries(places)
+    
+    # хранилище ФРТ создается один раз, чтобы процессы не читали csv региона для каждого города
+    if not os.path.exists(FRT_STORE):
+        build_frt_store(FRT_FOLDER, FRT_STORE)
+    # границы городов и регионов выгружаются один раз по всем городам, дальше город и регион определяются без Overpass
+    if not os.path.exists(ADMIN_BOUNDARIES) and len(geometries) > 0:
+        build_admin_boundaries(shapely.union_all(list(geometries.values())), ADMIN_BOUNDARIES)
+    
+    results = {}
+    failures = {place_name: ValueError('полигон не найден') for place_name in places if place_name not in geometries}
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        futures = {executor.submit(place_function, place_name, geometry): place_name
+                   for place_name, geometry in geometries.items()}
+        for i, future in enumerate(as_completed(futures), start = 1):
+            place_name = futures[future]
+            try:
+                results[place_name] = future.result()
+                print(f'[{i}/{len(futures)}] {place_name}: готово')
+            except Exception as e:
+                failures[place_name] = e
+                print(f'[{i}/{len(futures)}] {place_name}: ошибка {type(e).__name__}: {e}')
+    
+    # сохраняем исходный порядок городов
+    frames = [results[place_name] for place_name in places if place_name in results]
+    full_df = pd.concat(frames) if len(frames) > 0 else pd.DataFrame()
+    
+    return full_df, failures
+
+# Функция для параллельного сбора датасета по списку городов
+def get_places_data(places: list, max_workers: int = None) -> tuple:
+    return process_places_parallel(places, get_place_data, max_workers)
+
+# Функция для сбора признаков районов по списку городов
+def get_landuse_data(places: list, max_workers: int = None) -> pd.DataFrame:
+    
+    full_districts_df, failures = process_places_parallel(places, get_place_landuse_data, max_workers)
+    for place_name, error in failures.items():
+        print(f'Пропущен город {place_name}: {type(error).__name__}')
         
-    return full_districts_df
\ No newline at end of file
+    return full_districts_df
+
+
+if __name__ == '__main__':
+    places = ['Екатеринбург', 'Пермь', 'Алапаевск', 'Верхняя Пышма', 'Нижний Тагил']
+    full_df, failures = get_places_data(places)
@@ -0,0 +1,111 @@
+import os
+import ast
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from typing import Union
+from schema import apply_schema, validate_schema
+
+# Колонки с геометрией (в файлах хранятся как WKB)
+GEOMETRY_COLUMNS = ['geometry', 'point_geometry']
+# Колонки-списки (в файлах хранятся как списки, а не строки)
+LIST_COLUMNS = ['points_inside']
+
+# Размер группы строк в файле (и размер чанка при конвертации csv)
+CHUNK_SIZE = 100_000
+
+
+# Функция, приводящая object-колонки со значениями разных типов к строкам (parquet хранит один тип на колонку)
+# Колонки-списки (после чтения из parquet - массивы numpy) записываются как есть
+def make_parquet_safe(frame: pd.DataFrame) -> pd.DataFrame:
+    
+    frame = frame.copy()
+    geometry = frame.geometry.name if isinstance(frame, gpd.GeoDataFrame) else None
+    for column in frame.columns:
+        if column == geometry or frame[column].dtype != object:
+            continue
+        values = [value for value in frame[column] if isinstance(value, (list, tuple, np.ndarray)) or not pd.isna(value)]
+        if any(isinstance(value, (list, tuple, np.ndarray)) for value in values):
+            continue
+        types = set(type(value) for value in values)
+        if len(types) > 1:
+            frame[column] = frame[column].apply(lambda x: x if x != x or x is None else str(x))
+    
+    return frame
+
+# Функция для записи части датасета (например, одного города) в колоночном формате
+# Каждая часть - отдельный файл в папке датасета, геометрия хранится как WKB, списки - как списки, типы колонок - по схеме
+def write_dataset(frame: pd.DataFrame, folder: str, part_name: str, chunk_size: int = CHUNK_SIZE) -> str:
+    
+    os.makedirs(folder, exist_ok = True)
+    for violation in validate_schema(frame):
+        print(f'{part_name}: {violation}')
+    frame = make_parquet_safe(apply_schema(frame.copy()))
+    frame.columns = [str(column) for column in frame.columns]
+    
+    path = os.path.join(folder, f'{part_name}.parquet')
+    tmp_path = os.path.join(folder, f'{part_name}.parquet.tmp')
+    frame.to_parquet(tmp_path, index = False, row_group_size = chunk_size)
+    os.replace(tmp_path, path)
+    
+    return path
+
+# Функция для получения списка частей датасета (путь может быть папкой или одним файлом)
+def dataset_parts(path: str, parts: list = None) -> list:
+    
+    if not os.path.isdir(path):
+        return [path]
+    
+    files = sorted(file for file in os.listdir(path) if file.endswith('.parquet'))
+    if parts is not None:
+        files = [file for file in files if file[:-len('.parquet')] in parts]
+    
+    return [os.path.join(path, file) for file in files]
+
+# Функция для загрузки датасета с выбором колонок (читаются только нужные колонки)
+# parts - список частей (городов), по умолчанию загружаются все
+def load_dataset(path: str, columns: list = None, parts: list = None) -> Union[gpd.GeoDataFrame, pd.DataFrame]:
+    
+    frames = []
+    for file in dataset_parts(path, parts):
+        try:
+            frames.append(gpd.read_parquet(file, columns = columns))
+        except ValueError:
+            # геометрия не запрошена
+            frames.append(pd.read_parquet(file, columns = columns))
+    if len(frames) == 0:
+        return pd.DataFrame(columns = columns)
+    
+    # словари категорий разных частей не совпадают, после объединения колонки снова приводятся к схеме
+    return apply_schema(pd.concat(frames, ignore_index = True))
+
+# Функция для чтения табличных данных: csv старого формата (sep=';') или колоночного датасета
+def read_table(path: str, columns: list = None) -> pd.DataFrame:
+    
+    if path.endswith('.csv'):
+        return pd.read_csv(path, sep = ';', usecols = columns)
+    return load_dataset(path, columns = columns)
+
+# Функция для разбора колонок csv старого формата: геометрия из WKT, списки из строк, типы по схеме
+def parse_csv_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    
+    for column in LIST_COLUMNS:
+        if column in chunk.columns:
+            chunk[column] = chunk[column].apply(lambda x: ast.literal_eval(x) if type(x) == str else [])
+    
+    geometry = [column for column in GEOMETRY_COLUMNS if column in chunk.columns]
+    for column in geometry:
+        chunk[column] = gpd.GeoSeries.from_wkt(chunk[column], crs = 'EPSG:4326')
+    if 'geometry' in geometry:
+        chunk = gpd.GeoDataFrame(chunk, geometry = 'geometry', crs = 'EPSG:4326')
+    
+    return apply_schema(chunk)
+
+# Функция для перевода csv старого формата в колоночный датасет, csv читается чанками
+def convert_csv_dataset(csv_path: str, folder: str, chunk_size: int = CHUNK_SIZE) -> str:
+    
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    for i, chunk in enumerate(pd.read_csv(csv_path, sep = ';', chunksize = chunk_size)):
+        write_dataset(parse_csv_chunk(chunk), folder, f'{name}-{i:05d}', chunk_size)
+    
+    return folder
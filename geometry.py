@@ -1,22 +1,64 @@
 import geopandas as gpd
-from shapely.geometry import Polygon, MultiPolygon
-from shapely.ops import make_valid
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, MultiPolygon, box
 from math import cos, radians
+from typing import Union
 
 
-# Функция для подсчета площади для объектов в датафрейме
-# Считаем, что косинус не меняется в пределах местности
+# Функция для подсчета площади для объектов в датафрейме (м2)
+# Площадь считается в равновеликой азимутальной проекции Ламберта с центром в середине охвата, 
+# поэтому она верна и для больших территорий; геометрия датафрейма не меняется
 def count_square(dataframe: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     
-    geom = dataframe.geometry[dataframe.geometry.apply(lambda x: type(x) in [Polygon, MultiPolygon])].iloc[0]
-    cosine = cos(radians(geom.centroid.y))
+    geometry = dataframe.geometry
+    if geometry.crs is None:
+        geometry = geometry.set_crs('EPSG:4326')
+    geometry = geometry.to_crs('EPSG:4326')
     
-    if dataframe.geometry.crs.to_epsg() != 3857:
-        dataframe.geometry = dataframe.geometry.set_crs('EPSG:4326').to_crs('EPSG:3857')
+    is_polygon = geometry.geom_type.isin(['Polygon', 'MultiPolygon']).values
+    square = np.zeros(len(geometry), dtype = np.float64)
+    
+    if is_polygon.any():
+        polygons = geometry[is_polygon]
+        min_x, min_y, max_x, max_y = polygons.total_bounds
+        equal_area = f'+proj=laea +lat_0={(min_y + max_y) / 2} +lon_0={(min_x + max_x) / 2} +datum=WGS84 +units=m'
+        
+        polygons = np.asarray(polygons.to_crs(equal_area).values, dtype = object)
+        invalid = ~shapely.is_valid(polygons)
+        polygons[invalid] = shapely.make_valid(polygons[invalid])
+        square[is_polygon] = shapely.area(polygons)
+    
+    dataframe['geometry_square'] = square
+    
+    return dataframe
+
 
-    dataframe['geometry_square'] = dataframe.geometry.apply(
-        lambda x: 0 if type(x) not in [Polygon, MultiPolygon] else make_valid(x).area * (cosine ** 2) 
-    )
-    dataframe.geometry = dataframe.geometry.set_crs('EPSG:3857').to_crs('EPSG:4326')
+# Функция для разбиения полигона на сетку квадратных тайлов (размер тайла в километрах)
+# Возвращает только тайлы, пересекающиеся с полигоном
+def make_grid(polygon: Union[Polygon, MultiPolygon], tile_size_km: float) -> list:
+    
+    min_x, min_y, max_x, max_y = polygon.bounds
+    step_y = tile_size_km / 111.32
+    step_x = tile_size_km / (111.32 * cos(radians((min_y + max_y) / 2)))
+    
+    tiles = []
+    for y in np.arange(min_y, max_y, step_y):
+        for x in np.arange(min_x, max_x, step_x):
+            tile = box(x, y, x + step_x, y + step_y)
+            if tile.intersects(polygon):
+                tiles.append(tile)
+                
+    return tiles
+
+# Функция для получения полигональной части геометрии (например, пересечения тайла с границей города)
+# Точки и линии на стыке отбрасываются, если полигонов нет - возвращается None
+def polygonal_part(geometry) -> Union[Polygon, MultiPolygon, None]:
+    
+    # составные части (коллекции, мультиполигоны) раскладываются до простых геометрий
+    parts = shapely.get_parts(shapely.get_parts(geometry))
+    parts = [part for part in parts if isinstance(part, Polygon) and not part.is_empty]
+    if len(parts) == 0:
+        return None
     
-    return dataframe
\ No newline at end of file
+    return parts[0] if len(parts) == 1 else MultiPolygon(parts)
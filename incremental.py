@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import xml.etree.ElementTree as ET
+from typing import Union
+from shapely import STRtree, box, union_all, intersects
+from shapely.geometry import Polygon, MultiPolygon, Point
+from shapely.validation import make_valid
+from geometry import polygonal_part
+from collector import PipelineContext, enrich_data, get_city_and_region_from_polygon
+from utils import choose_frt_file, modify_address_to_join, merge_osm_frt, extract_districts_features
+from checkpoints import place_checkpoint_key, load_stage, save_stage, run_place_checkpointed
+from preprocessor import points_to_lists
+from schema import apply_schema
+
+# Ключ здания в датасетах
+BUILDING_KEY = ['element_type', 'osmid']
+# Ключ района землепользования в датасетах
+LANDUSE_KEY = ['element_type_landuse', 'osmid_landuse']
+
+
+# Функция для чтения файла изменений OSM (osmChange XML) потоково
+# Возвращает датафрейм: действие (create/modify/delete), тип и id элемента, координаты узла, теги, ссылки на узлы
+def parse_osm_change(path: str) -> pd.DataFrame:
+    
+    rows = []
+    action = None
+    for event, elem in ET.iterparse(path, events = ('start', 'end')):
+        if event == 'start' and elem.tag in ['create', 'modify', 'delete']:
+            action = elem.tag
+        elif event == 'end' and elem.tag in ['node', 'way', 'relation']:
+            rows.append({
+                'action': action,
+                'element_type': elem.tag,
+                'osmid': int(elem.get('id')),
+                'lat': float(elem.get('lat')) if elem.get('lat') is not None else np.nan,
+                'lon': float(elem.get('lon')) if elem.get('lon') is not None else np.nan,
+                'tags': {tag.get('k'): tag.get('v') for tag in elem.findall('tag')},
+                'refs': [int(nd.get('ref')) for nd in elem.findall('nd')]
+            })
+            elem.clear()
+    
+    columns = ['action', 'element_type', 'osmid', 'lat', 'lon', 'tags', 'refs']
+    return pd.DataFrame(rows, columns = columns)
+
+# Функция для получения точек изменений: узлы с координатами и узлы измененных линий, если они есть в файле
+def change_points(change: pd.DataFrame) -> pd.DataFrame:
+    
+    nodes = change[(change.element_type == 'node') & change.lat.notna()]
+    positions = dict(zip(nodes.osmid, zip(nodes.lon, nodes.lat)))
+    
+    points = [(row.element_type, row.osmid, Point(row.lon, row.lat)) for row in nodes.itertuples()]
+    for row in change[change.element_type != 'node'].itertuples():
+        points += [(row.element_type, row.osmid, Point(positions[ref])) for ref in row.refs if ref in positions]
+    
+    return pd.DataFrame(points, columns = ['element_type', 'osmid', 'geometry'])
+
+# Функция для поиска зданий, затронутых изменениями
+# Здание затронуто, если оно само есть в изменениях, или внутри него лежит измененный узел (точка интереса или вершина)
+def find_affected_buildings(change: pd.DataFrame, buildings: gpd.GeoDataFrame) -> tuple:
+    
+    changed = set(zip(change.element_type, change.osmid))
+    stored = set(zip(buildings.element_type, buildings.osmid.astype(np.int64)))
+    affected = changed & stored
+    
+    points = change_points(change)
+    tree = STRtree(np.asarray(buildings.geometry.values, dtype = object))
+    _, building_index = tree.query(np.asarray(points.geometry.values, dtype = object), predicate = 'intersects')
+    affected |= set(zip(buildings.element_type.values[building_index], buildings.osmid.astype(np.int64).values[building_index]))
+    
+    deleted = set(zip(change[change.action == 'delete'].element_type, change[change.action == 'delete'].osmid))
+    
+    return affected, deleted, points
+
+# Функция, возвращающая маску строк датафрейма, ключи которых входят в множество
+def keys_mask(df: pd.DataFrame, keys: set, columns: list = BUILDING_KEY) -> np.ndarray:
+    
+    frame_keys = zip(df[columns[0]], pd.to_numeric(df[columns[1]], errors = 'coerce'))
+    return np.array([key in keys for key in frame_keys], dtype = bool)
+
+# Функция для инкрементального обновления сохраненных этапов города по файлу изменений OSM
+# Пересчитываются только затронутые здания и районы, в которых они лежат, стоимость зависит от размера изменений
+# extract_path - локальная выгрузка OSM, к которой уже применен файл изменений (путь тот же, что при полной обработке)
+def apply_osm_change(place_name: str, polygon: Union[Polygon, MultiPolygon], change_path: str, only_people: bool,
+                     frt_folder: str = 'frt_datasets', frt_store: str = None, admin_boundaries: str = None,
+                     folder: str = 'checkpoints', buffer: float = 0.0005, verbose: bool = False, extract_path: str = None) -> dict:
+    
+    key = place_checkpoint_key(polygon, only_people, frt_store or frt_folder, extract_path)
+    enriched = load_stage(folder, key, 'enriched')
+    merged = load_stage(folder, key, 'frt_merge')
+    dataset = load_stage(folder, key, 'dataset')
+    
+    # сохраненных этапов нет - обновлять нечего, город обрабатывается полностью
+    if enriched is None or merged is None or dataset is None:
+        return run_place_checkpointed(place_name, polygon, only_people, frt_folder, frt_store, admin_boundaries, folder,
+                                      verbose = verbose, extract_path = extract_path)
+    
+    change = parse_osm_change(change_path)
+    buildings = merged['buildings']
+    affected, deleted, points = find_affected_buildings(change, buildings)
+    # изменения за границей города не учитываются
+    points = points[intersects(np.asarray(points.geometry.values, dtype = object), polygon)]
+    
+    # область пересчета: затронутые здания, точки изменений и районы, в которых они лежат
+    landuse_districts = enriched['landuse_districts']
+    areas = list(buildings.geometry[keys_mask(buildings, affected)].envelope.buffer(buffer))
+    areas += [box(*point.buffer(buffer).bounds) for point in points.geometry]
+    if len(areas) == 0:
+        return {'buildings': buildings, 'districts': dataset['districts']}
+    
+    district_tree = STRtree(np.asarray(landuse_districts.geometry.values, dtype = object))
+    _, district_index = district_tree.query(np.asarray(areas, dtype = object), predicate = 'intersects')
+    refresh_districts = landuse_districts.iloc[np.unique(district_index)]
+    areas += list(refresh_districts.geometry.values)
+    refresh_area = polygonal_part(make_valid(union_all(np.asarray(areas, dtype = object)).intersection(polygon)))
+    if refresh_area is None:
+        return {'buildings': buildings, 'districts': dataset['districts']}
+    if verbose:
+        print(f'Затронуто зданий: {len(affected)}, удалено элементов: {len(deleted)}')
+    
+    # пересчет: сбор OSM по области изменений, транспортные районы не строятся заново, а берутся сохраненные
+    context = PipelineContext(place_name = place_name, transport_districts = enriched['transport_districts'])
+    fresh = enrich_data(refresh_area, verbose = verbose, only_people = only_people, cache = False, context = context,
+                        extract_path = extract_path)
+    fresh['osmid'] = fresh['osmid'].astype(np.int64)
+    changed = set(zip(change.element_type, change.osmid))
+    fresh = fresh[keys_mask(fresh, (affected | changed) - deleted)]
+    fresh = fresh.drop_duplicates(subset = BUILDING_KEY)
+    
+    # строки тегов новых зданий дописываются в конец сохраненных, points_row сдвигается на их число
+    points_inside = enriched['points_inside']
+    fresh['points_row'] = fresh['points_row'] + len(points_inside)
+    enriched['points_inside'] = pd.concat([points_inside, pd.DataFrame(
+        {'points_inside': points_to_lists(context.points_inside, context.points_vocabulary)})], ignore_index = True)
+    
+    patched_keys = affected | deleted | set(zip(fresh.element_type, fresh.osmid))
+    enriched['buildings'] = apply_schema(
+        pd.concat([enriched['buildings'][~keys_mask(enriched['buildings'], patched_keys)], fresh]))
+    
+    city_region = get_city_and_region_from_polygon(polygon, boundaries = admin_boundaries)
+    frt_data = choose_frt_file(city_region, frt_folder, store = frt_store)
+    fresh = merge_osm_frt(df_osm = modify_address_to_join(fresh.copy()), df_frt = frt_data)
+    merged['buildings'] = apply_schema(pd.concat([buildings[~keys_mask(buildings, patched_keys)], fresh], ignore_index = True))
+    merged['points_inside'] = enriched['points_inside']
+    
+    # районы с затронутыми зданиями: признаки районов пересчитываются по всем их зданиям
+    # заменяются только районы, целиком вошедшие в область пересчета (у остальных подсчеты объектов неполные)
+    district_keys = set(zip(refresh_districts.element_type_landuse, refresh_districts.osmid_landuse))
+    fresh_districts = context.landuse_districts
+    fresh_districts = fresh_districts[keys_mask(fresh_districts, district_keys, LANDUSE_KEY)]
+    enriched['landuse_districts'] = apply_schema(pd.concat([
+        landuse_districts[~keys_mask(landuse_districts, district_keys, LANDUSE_KEY)], fresh_districts], ignore_index = True))
+    
+    touched = set(zip(buildings[keys_mask(buildings, patched_keys)].element_type_landuse,
+                      pd.to_numeric(buildings[keys_mask(buildings, patched_keys)].osmid_landuse, errors = 'coerce')))
+    touched |= set(zip(fresh.element_type_landuse, pd.to_numeric(fresh.osmid_landuse, errors = 'coerce')))
+    district_buildings = merged['buildings'][keys_mask(merged['buildings'], touched, LANDUSE_KEY)]
+    districts = extract_districts_features(district_buildings, enriched['landuse_districts'], LANDUSE_KEY)
+    dataset['districts'] = apply_schema(pd.concat([
+        dataset['districts'][~keys_mask(dataset['districts'], touched, LANDUSE_KEY)], districts], ignore_index = True))
+    
+    for stage, frames in [('enriched', enriched), ('frt_merge', merged), ('dataset', dataset)]:
+        save_stage(folder, key, stage, frames)
+    
+    return {'buildings': merged['buildings'], 'districts': dataset['districts']}
@@ -0,0 +1,76 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier, CatBoostRegressor
+from dataset_io import read_table
+
+
+# Функция для получения пути к файлу с метаданными модели (лежит рядом с моделью: model.cbm -> model.meta.json)
+def metadata_path(model_path: str) -> str:
+    return f'{os.path.splitext(model_path)[0]}.meta.json'
+
+# Функция для сохранения модели вместе с метаданными
+# labels - классы по порядку кодов, на которых обучалась модель, categories - словари категориальных признаков
+def save_model(model, model_path: str, labels: list = None, categories: dict = None) -> str:
+
+    model.save_model(model_path, format = 'cbm')
+    with open(metadata_path(model_path), 'w', encoding = 'utf-8') as file:
+        json.dump({'labels': labels, 'categories': categories}, file, ensure_ascii = False)
+
+    return model_path
+
+# Функция для получения классов по датасету, на котором обучалась модель (коды - порядок категорий колонки)
+# Нужна для моделей, сохраненных без метаданных: классы восстанавливаются один раз и записываются рядом с моделью
+def labels_from_dataset(dataset_path: str, column: str = 'landuse_people') -> list:
+
+    labels = read_table(dataset_path, columns = [column])[column].astype(object).astype('category')
+    return [str(label) for label in labels.cat.categories]
+
+
+# Реестр моделей: каждая модель и ее метаданные загружаются с диска один раз и переиспользуются всеми вызовами
+# thread_count - число потоков CatBoost при предсказании (-1 - все ядра)
+class ModelRegistry:
+
+    def __init__(self, thread_count: int = -1):
+        self.thread_count = thread_count
+        self.models = {}
+        self.lock = threading.Lock()
+
+    # модель и метаданные по пути (dataset_path - датасет для восстановления классов, если метаданных нет)
+    def get(self, model_path: str, classifier: bool = True, dataset_path: str = None) -> tuple:
+
+        key = os.path.abspath(model_path)
+        with self.lock:
+            if key not in self.models:
+                model = CatBoostClassifier() if classifier else CatBoostRegressor()
+                model.load_model(model_path, format = 'cbm')
+
+                metadata = {'labels': None, 'categories': None}
+                if os.path.exists(metadata_path(model_path)):
+                    with open(metadata_path(model_path), encoding = 'utf-8') as file:
+                        metadata = json.load(file)
+                elif dataset_path is not None:
+                    metadata['labels'] = labels_from_dataset(dataset_path)
+                    with open(metadata_path(model_path), 'w', encoding = 'utf-8') as file:
+                        json.dump(metadata, file, ensure_ascii = False)
+
+                self.models[key] = (model, metadata)
+            return self.models[key]
+
+    # предсказание для всех строк одним вызовом модели, коды классов переводятся в классы по метаданным
+    def predict(self, model_path: str, features: pd.DataFrame, classifier: bool = True, dataset_path: str = None) -> np.ndarray:
+
+        model, metadata = self.get(model_path, classifier, dataset_path)
+        if len(features) == 0:
+            return np.empty(0, dtype = object)
+
+        pred = np.asarray(model.predict(features, thread_count = self.thread_count)).flatten()
+        if classifier and metadata['labels'] is not None:
+            pred = np.asarray(metadata['labels'], dtype = object)[pred.astype(np.int64)]
+
+        return pred
+
+# Общий реестр процесса
+registry = ModelRegistry()
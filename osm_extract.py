@@ -0,0 +1,162 @@
+import os
+import bz2
+import gzip
+import hashlib
+import shapely
+import xml.etree.ElementTree as ET
+from typing import Union
+from shapely.geometry import Polygon, MultiPolygon
+
+# Папка для вырезанных из выгрузки фрагментов (по одному на полигон)
+EXTRACT_CACHE = 'extract_cache'
+
+
+# Класс для отбора элементов выгрузки OSM, попадающих в охват полигона
+# Узлы внутри охвата, линии хотя бы с одним таким узлом (со всеми своими узлами), отношения с такими участниками
+# (со всеми линиями-участниками, чтобы мультиполигоны собирались целиком)
+class ExtractSelection:
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.nodes = set()
+        self.ways = set()
+        self.relations = set()
+        self.member_ways = set()
+    
+    def on_node(self, osmid: int, lon: float, lat: float) -> None:
+        min_x, min_y, max_x, max_y = self.bounds
+        if min_x <= lon <= max_x and min_y <= lat <= max_y:
+            self.nodes.add(osmid)
+    
+    def on_way(self, osmid: int, refs: list) -> None:
+        if any(ref in self.nodes for ref in refs):
+            self.ways.add(osmid)
+    
+    def on_relation(self, osmid: int, members: list) -> None:
+        if any((kind == 'way' and ref in self.ways) or (kind == 'node' and ref in self.nodes) for kind, ref in members):
+            self.relations.add(osmid)
+            self.member_ways.update(ref for kind, ref in members if kind == 'way')
+    
+    # второй проход по линиям: узлы всех отобранных линий и линий-участников отношений
+    def on_way_nodes(self, osmid: int, refs: list) -> None:
+        if osmid in self.ways or osmid in self.member_ways:
+            self.ways.add(osmid)
+            self.nodes.update(refs)
+
+# Функция для открытия xml выгрузки (в том числе сжатой bz2/gz)
+def open_osm_xml(path: str):
+    
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+# Функция для потокового прохода по xml выгрузке: вызывает handler для каждого узла/линии/отношения и освобождает память
+def iterate_osm_xml(path: str, handler) -> None:
+    
+    with open_osm_xml(path) as file:
+        root = None
+        for event, elem in ET.iterparse(file, events = ('start', 'end')):
+            if root is None:
+                root = elem
+            if event == 'end' and elem.tag in ['node', 'way', 'relation']:
+                handler(elem)
+                root.clear()
+
+# Функция для вырезания из xml выгрузки элементов в охвате полигона (три потоковых прохода, в памяти только id)
+def filter_xml_extract(source: str, bounds: tuple, output: str) -> str:
+    
+    selection = ExtractSelection(bounds)
+    
+    def select(elem):
+        osmid = int(elem.get('id'))
+        if elem.tag == 'node':
+            selection.on_node(osmid, float(elem.get('lon')), float(elem.get('lat')))
+        elif elem.tag == 'way':
+            selection.on_way(osmid, [int(nd.get('ref')) for nd in elem.iter('nd')])
+        else:
+            selection.on_relation(osmid, [(member.get('type'), int(member.get('ref'))) for member in elem.iter('member')])
+    
+    def select_way_nodes(elem):
+        if elem.tag == 'way':
+            selection.on_way_nodes(int(elem.get('id')), [int(nd.get('ref')) for nd in elem.iter('nd')])
+    
+    iterate_osm_xml(source, select)
+    iterate_osm_xml(source, select_way_nodes)
+    
+    kept = {'node': selection.nodes, 'way': selection.ways, 'relation': selection.relations}
+    with open(output, 'wb') as out:
+        out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="osm_extract">\n')
+    
+        def write(elem):
+            if int(elem.get('id')) in kept[elem.tag]:
+                elem.tail = '\n'
+                out.write(ET.tostring(elem, encoding = 'utf-8', xml_declaration = False))
+    
+        iterate_osm_xml(source, write)
+        out.write(b'</osm>\n')
+    
+    return output
+
+# Функция для вырезания из pbf выгрузки элементов в охвате полигона (нужен пакет osmium)
+def filter_pbf_extract(source: str, bounds: tuple, output: str) -> str:
+    
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError('Для чтения .pbf выгрузок нужен пакет osmium (pip install osmium)')
+    
+    selection = ExtractSelection(bounds)
+    
+    class Selector(osmium.SimpleHandler):
+        def node(self, n):
+            selection.on_node(n.id, n.location.lon, n.location.lat)
+        def way(self, w):
+            selection.on_way(w.id, [nd.ref for nd in w.nodes])
+        def relation(self, r):
+            selection.on_relation(r.id, [({'n': 'node', 'w': 'way', 'r': 'relation'}[m.type], m.ref) for m in r.members])
+    
+    class WayNodes(osmium.SimpleHandler):
+        def way(self, w):
+            selection.on_way_nodes(w.id, [nd.ref for nd in w.nodes])
+    
+    Selector().apply_file(source)
+    WayNodes().apply_file(source)
+    
+    writer = osmium.SimpleWriter(output)
+    
+    class Writer(osmium.SimpleHandler):
+        def node(self, n):
+            if n.id in selection.nodes:
+                writer.add_node(n)
+        def way(self, w):
+            if w.id in selection.ways:
+                writer.add_way(w)
+        def relation(self, r):
+            if r.id in selection.relations:
+                writer.add_relation(r)
+    
+    Writer().apply_file(source)
+    writer.close()
+    
+    return output
+
+# Функция для получения фрагмента выгрузки по полигону (xml), фрагмент кэшируется на диске
+def prepare_extract(source: str, polygon: Union[Polygon, MultiPolygon], cache_folder: str = EXTRACT_CACHE) -> str:
+    
+    key = hashlib.sha1(shapely.to_wkb(shapely.normalize(polygon)))
+    key.update(f'{os.path.abspath(source)}|{os.path.getmtime(source)}'.encode())
+    output = os.path.join(cache_folder, f'{key.hexdigest()}.osm')
+    if os.path.exists(output):
+        return output
+    
+    os.makedirs(cache_folder, exist_ok = True)
+    tmp_output = output.replace('.osm', '.tmp.osm')
+    if source.endswith('.pbf'):
+        filter_pbf_extract(source, polygon.bounds, tmp_output)
+    else:
+        filter_xml_extract(source, polygon.bounds, tmp_output)
+    os.replace(tmp_output, output)
+    
+    return output
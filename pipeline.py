@@ -0,0 +1,74 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from collector import PipelineContext, enrich_data, get_city_and_region_from_polygon
+from utils import choose_frt_file, build_frt_address_index, modify_address_to_join, merge_osm_frt
+from preprocessor import TagVocabulary
+
+
+# Конвейер OSM -> ФРТ для нескольких городов в потоках одного процесса
+# Результаты каждого города хранятся в своем PipelineContext, общие ресурсы (индексы адресов ФРТ) загружаются один раз,
+# словарь тегов точек внутри зданий общий, поэтому матрицы тегов всех городов совместимы
+class Pipeline:
+    
+    def __init__(self, frt_folder: str = 'frt_datasets', frt_store: str = None, admin_boundaries: str = None,
+                 only_people: bool = False, cache: bool = True, verbose: bool = False):
+        self.frt_folder = frt_folder
+        self.frt_store = frt_store
+        self.admin_boundaries = admin_boundaries
+        self.only_people = only_people
+        self.cache = cache
+        self.verbose = verbose
+        self.frt_indexes = {}
+        self.points_vocabulary = TagVocabulary()
+        self.lock = threading.Lock()
+    
+    # Индекс адресов ФРТ для города (строится один раз и переиспользуется всеми потоками)
+    # Под общей блокировкой только берется future города: чтение ФРТ одного города не задерживает потоки других городов
+    def frt_index(self, city_region: tuple) -> dict:
+        
+        with self.lock:
+            future = self.frt_indexes.get(city_region)
+            owner = future is None
+            if owner:
+                future = self.frt_indexes[city_region] = Future()
+        
+        if owner:
+            try:
+                frt_data = choose_frt_file(city_region, self.frt_folder, store = self.frt_store)
+                future.set_result(build_frt_address_index(frt_data))
+            except Exception as e:
+                # ошибка передается ожидающим потокам, следующий вызов попробует построить индекс заново
+                with self.lock:
+                    del self.frt_indexes[city_region]
+                future.set_exception(e)
+        
+        return future.result()
+    
+    # Обработка одного города: сбор OSM, соединение с ФРТ
+    def run(self, place_name: str, place_geometry) -> PipelineContext:
+        
+        context = PipelineContext(place_name = place_name, points_vocabulary = self.points_vocabulary)
+        buildings = enrich_data(place_geometry, verbose = self.verbose, only_people = self.only_people,
+                                cache = self.cache, context = context)
+        city_region = get_city_and_region_from_polygon(place_geometry, boundaries = self.admin_boundaries)
+        buildings = modify_address_to_join(buildings)
+        context.buildings = merge_osm_frt(df_osm = buildings, df_frt = None, frt_index = self.frt_index(city_region))
+        
+        return context
+    
+    # Обработка нескольких городов в пуле потоков, ошибка в одном городе не останавливает остальные
+    def run_many(self, geometries: dict, max_workers: int = 4) -> tuple:
+        
+        contexts, failures = {}, {}
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            futures = {executor.submit(self.run, place_name, geometry): place_name for place_name, geometry in geometries.items()}
+            for i, future in enumerate(as_completed(futures), start = 1):
+                place_name = futures[future]
+                try:
+                    contexts[place_name] = future.result()
+                    print(f'[{i}/{len(futures)}] {place_name}: готово')
+                except Exception as e:
+                    failures[place_name] = e
+                    print(f'[{i}/{len(futures)}] {place_name}: ошибка {type(e).__name__}: {e}')
+                    
+        return contexts, failures
@@ -1,38 +1,13 @@
 
+import json
+import threading
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from shapely import STRtree
 from typing import Union
-
-# Функция для получения корректного числа этажей в здании (также используется для коррекции квартир в здании)
-def validate_levels(levels: Union[str, float]) -> int:
-    
-    if check_nan(levels):
-        levels = 0
-        
-    if isinstance(levels, str):
-        if levels.isnumeric():
-            levels = int(levels)
-        elif any([';' in levels, '-' in levels, ', ' in levels]):
-            levels = levels.replace(';', '*').replace('-', '*').replace(', ', '*')
-            levels = levels.split('*')
-            if '' in levels:
-                levels.remove('')
-            levels = list(map(lambda x: int(keep_only_numbers(x)), levels))
-            levels = int(round(np.mean(levels), 0))
-        elif any([',' in levels, '.' in levels]):
-            levels = levels.replace(',', '.')
-            levels = int(round(float(levels), 0))
-        else:
-            levels = keep_only_numbers(levels)
-            if levels == '':
-                levels = 1
-            levels = int(levels)
-            
-    if isinstance(levels, float):
-        levels = int(round(levels, 0))
-        
-    return levels
+from utils import parse_levels, is_sublist
 
 # Функция для предподготовки датафрейма со зданиями
 def building_df_preprocess(df: pd.DataFrame, columns: list) -> pd.DataFrame:
@@ -42,9 +17,9 @@ def building_df_preprocess(df: pd.DataFrame, columns: list) -> pd.DataFrame:
     df = df[df.element_type.isin(['way', 'relation'])]
     
     if 'building:levels' in df.columns:
-        df['building:levels'] = [validate_levels(l) for l in df['building:levels']]
+        df['building:levels'] = parse_levels(df['building:levels'])
     if 'building:flats' in df.columns:
-        df['building:flats'] = [validate_levels(f) for f in df['building:flats']]
+        df['building:flats'] = parse_levels(df['building:flats'])
     else:
         df['building:flats'] = 0
             
@@ -84,71 +59,144 @@ def modify_dataframes(dataframes: dict, columns: list) -> dict:
     dataframes = {**dataframes, **extra_dfs}
     return dataframes
 
-# Вспомогательная функция, которая возвращает все точки внутри здания
-def points_inside_building(dataframes: dict, df_buildings: gpd.GeoDataFrame, cols: list) -> gpd.GeoDataFrame:
+# Общий словарь тегов точек внутри зданий (amenity, shop, office и др.): тег -> номер колонки разреженной матрицы
+# Словарь только пополняется, поэтому матрицы разных городов с одним словарем совместимы (у ранних меньше колонок)
+class TagVocabulary:
     
-    for k in dataframes.keys():
-        if k not in ['building', 'landuse', 'amenity', 'playgrounds', 'parkings']:
-            df_buildings = df_buildings.sjoin(dataframes[k], how='left')
-            indexes = [column for column in df_buildings.columns if column in ['index', 'index_right', 'index_left']]
-            df_buildings.drop(columns=indexes, inplace=True)
-            tmp = df_buildings.groupby(['element_type', 'osmid'])[k].agg(
-                lambda x: x.tolist()).reset_index()
-            df_buildings = df_buildings.merge(tmp, how='left', on=['element_type', 'osmid'])
-            df_buildings.drop(columns=[f'{k}_x'], inplace=True)
-            df_buildings.rename(columns = {f'{k}_y' : f'{k}'}, inplace=True)
-            df_buildings.drop_duplicates(subset=['element_type', 'osmid'], inplace = True)
-            df_buildings = gpd.GeoDataFrame(df_buildings).set_geometry('geometry').set_crs('EPSG:4326')
+    def __init__(self, tags: list = None):
+        self.tags = []
+        self.index = {}
+        self.lock = threading.Lock()
+        self.encode(tags or [])
+    
+    def __len__(self) -> int:
+        return len(self.tags)
+    
+    # номера колонок для тегов, новые теги добавляются в конец словаря
+    def encode(self, tags) -> np.ndarray:
+        codes, uniques = pd.factorize(np.asarray(tags, dtype = object))
+        with self.lock:
+            for tag in uniques:
+                if tag not in self.index:
+                    self.index[tag] = len(self.tags)
+                    self.tags.append(tag)
+            mapping = np.array([self.index[tag] for tag in uniques], dtype = np.int32)
+        return mapping[codes]
+    
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding = 'utf-8') as file:
+            json.dump(self.tags, file, ensure_ascii = False)
+    
+    @classmethod
+    def load(cls, path: str) -> 'TagVocabulary':
+        with open(path, encoding = 'utf-8') as file:
+            return cls(json.load(file))
 
-    extra_columns = [column for column in df_buildings.columns if column not in cols]
-    points = df_buildings[extra_columns].copy()
+# Функция для подсчета точек (amenity, shop, office и др.) внутри зданий: один запрос к STRtree по всем слоям
+# Теги хранятся в разреженной матрице счетчиков (строка - здание, колонка - тег словаря), в датафрейме зданий
+# остается только номер строки матрицы points_row, возвращается датафрейм и матрица
+def points_inside_building(dataframes: dict, df_buildings: gpd.GeoDataFrame, cols: list, counts: bool = False,
+                           vocabulary: TagVocabulary = None) -> tuple:
+    
+    if vocabulary is None:
+        vocabulary = TagVocabulary()
+    
+    df_buildings = df_buildings.drop_duplicates(subset = ['element_type', 'osmid'])
     cols = [col for col in cols if col in df_buildings.columns]
-    df_buildings = df_buildings[cols]
+    df_buildings = gpd.GeoDataFrame(df_buildings[cols]).set_geometry('geometry').set_crs('EPSG:4326', allow_override = True)
+    
+    layers = [k for k in dataframes.keys() if k not in ['building', 'landuse', 'amenity', 'playgrounds', 'parkings']]
+    geometries = np.concatenate([np.asarray(dataframes[k].geometry.values, dtype = object) for k in layers] + [np.empty(0, dtype = object)])
+    tags = np.concatenate([np.asarray(dataframes[k][k].values, dtype = object) for k in layers] + [np.empty(0, dtype = object)])
+    
+    # остаются только строковые теги, кроме 'yes'
+    valid = np.array([type(tag) == str and tag != 'yes' for tag in tags], dtype = bool)
+    geometries, tags = geometries[valid], tags[valid]
+    
+    tree = STRtree(np.asarray(df_buildings.geometry.values, dtype = object))
+    point_index, building_index = tree.query(geometries, predicate = 'intersects')
+    
+    # повторяющиеся пары (здание, тег) суммируются в счетчик
+    columns = vocabulary.encode(tags[point_index])
+    matrix = sparse.csr_matrix((np.ones(len(columns), dtype = np.int32), (building_index, columns)),
+                               shape = (len(df_buildings), len(vocabulary)))
+    
+    df_buildings['points_row'] = np.arange(len(df_buildings))
+    if counts:
+        df_buildings['points_count'] = np.bincount(building_index, minlength = len(df_buildings))
+    
+    return df_buildings, matrix
 
-    points = points.progress_apply(
-        lambda row: flatten_list([row[col] for col in extra_columns if not check_nan(row[col])]), axis=1)
-    df_buildings['points_inside'] = points
-    df_buildings.points_inside = df_buildings.points_inside.apply(lambda x: [i for i in x if type(i) != int])
-    df_buildings.points_inside = df_buildings.points_inside.apply(
-        lambda x: [elem for elem in x if type(elem) == str and elem != 'yes'])
+# Функция для перевода строк матрицы тегов в списки тегов (для записи в файлы и просмотра)
+# rows - номера строк матрицы (колонка points_row), по умолчанию все строки
+def points_to_lists(matrix: sparse.csr_matrix, vocabulary: TagVocabulary, rows: np.ndarray = None) -> list:
+    
+    matrix = matrix.tocsr() if rows is None else matrix.tocsr()[np.asarray(rows, dtype = np.int64)]
+    tags = np.asarray(vocabulary.tags, dtype = object)
+    
+    return [np.repeat(tags[matrix.indices[start:end]], matrix.data[start:end]).tolist()
+            for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:])]
 
-    return df_buildings
+# Функция для перевода списков тегов в матрицу тегов (например, после чтения датасета со списками)
+def lists_to_points(lists, vocabulary: TagVocabulary) -> sparse.csr_matrix:
+    
+    lists = [x if isinstance(x, (list, np.ndarray)) else [] for x in lists]
+    rows = np.repeat(np.arange(len(lists)), [len(x) for x in lists])
+    columns = vocabulary.encode(np.concatenate([np.asarray(x, dtype = object) for x in lists] + [np.empty(0, dtype = object)]))
+    
+    return sparse.csr_matrix((np.ones(len(columns), dtype = np.int32), (rows, columns)),
+                             shape = (len(lists), len(vocabulary)))
+
+# Функция для получения признаков модели из матрицы тегов: строки по points_row зданий, колонки points_<тег>
+# Колонки разреженные (pandas SparseDtype), min_count - минимальное число зданий с тегом, редкие теги отбрасываются
+def points_features(df_buildings: pd.DataFrame, matrix: sparse.csr_matrix, vocabulary: TagVocabulary,
+                    min_count: int = 1) -> pd.DataFrame:
+    
+    matrix = matrix.tocsr()[df_buildings.points_row.values.astype(np.int64)]
+    matrix.resize((matrix.shape[0], len(vocabulary)))
+    keep = np.flatnonzero(np.asarray((matrix > 0).sum(axis = 0)).ravel() >= min_count)
+    
+    return pd.DataFrame.sparse.from_spmatrix(matrix[:, keep], index = df_buildings.index,
+                                             columns = [f'points_{vocabulary.tags[i]}' for i in keep])
+
+# Функция для подсчета объектов слоев внутри районов без sjoin: один запрос к STRtree на слой и bincount по районам
+# layers - словарь {название колонки: слой}, first_columns - колонки районов, которые переносятся как есть
+def count_layers_in_districts(districts: gpd.GeoDataFrame, layers: dict, group_by: Union[list, str],
+                              first_columns: list = ['geometry']) -> gpd.GeoDataFrame:
+    
+    group_by = [group_by] if isinstance(group_by, str) else group_by
+    groups = districts.groupby(group_by, observed = True)
+    codes = groups.ngroup().values
+    result = groups.agg(**{column: (column, 'first') for column in first_columns})
+    
+    district_geometries = np.asarray(districts.geometry.values, dtype = object)
+    for name, layer in layers.items():
+        tree = STRtree(np.asarray(layer.geometry.values, dtype = object))
+        district_index, layer_index = tree.query(district_geometries, predicate = 'intersects')
+        # объект считается в районе один раз, даже если район встречается в нескольких строках
+        pairs = np.unique(np.stack([codes[district_index], layer_index], axis = 1), axis = 0)
+        result[name] = np.bincount(pairs[:, 0], minlength = len(result))
+    
+    result = gpd.GeoDataFrame(result.reset_index()).set_geometry('geometry').set_crs('EPSG:4326', allow_override = True)
+    
+    return result
 
 # Функция, соединяющая транспортные районы и фичи
-def join_districts_parkings_playgrounds(districts: gpd.GeoDataFrame, group_by: Union[list, str]) -> gpd.GeoDataFrame:
+def join_districts_parkings_playgrounds(districts: gpd.GeoDataFrame, group_by: Union[list, str], dataframes: dict) -> gpd.GeoDataFrame:
     
-    districts = districts.sjoin(dataframes['parkings'], how = 'left', rsuffix = 'parking')
-    districts = districts.sjoin(dataframes['playgrounds'], how = 'left', rsuffix = 'playground')
-    schools = dataframes['amenity'][dataframes['amenity'].amenity == 'school'][['geometry']]
-    kindergartens = dataframes['amenity'][dataframes['amenity'].amenity == 'kindergarten'][['geometry']]
-    districts = districts.sjoin(schools, how = 'left', rsuffix = 'school')
-    districts = districts.sjoin(kindergartens, how = 'left', rsuffix = 'kindergarten')
+    layers = {
+        'parkings': dataframes['parkings'],
+        'playgrounds': dataframes['playgrounds'],
+        'kindergartens': dataframes['amenity'][dataframes['amenity'].amenity == 'kindergarten'],
+        'schools': dataframes['amenity'][dataframes['amenity'].amenity == 'school']
+    }
     
+    first_columns = ['geometry']
     if is_sublist(['landuse', 'residential'], districts.columns):
-        districts = gpd.GeoDataFrame(
-            districts.groupby(group_by).agg(
-                parkings = ('index_parking', 'nunique'),
-                playgrounds = ('index_playground', 'nunique'),
-                geometry = ('geometry', 'first'),
-                landuse = ('landuse', 'first'),
-                residential = ('residential', 'first'),
-                kindergartens = ('index_kindergarten', 'nunique'),
-                schools = ('index_school', 'nunique')
-            )
-        )
-        
-    else:
-        districts = gpd.GeoDataFrame(
-            districts.groupby(group_by).agg(
-                parkings = ('index_parking', 'nunique'),
-                playgrounds = ('index_playground', 'nunique'),
-                geometry = ('geometry', 'first'),
-                kindergartens = ('index_kindergarten', 'nunique'),
-                schools = ('index_school', 'nunique')
-            )
-        )
-    
-    districts = districts.reset_index().set_geometry('geometry').set_crs('EPSG:4326')
+        first_columns += ['landuse', 'residential']
+    
+    districts = count_layers_in_districts(districts, layers, group_by, first_columns)
+    group_by = [group_by] if isinstance(group_by, str) else group_by
+    districts = districts[group_by + ['parkings', 'playgrounds'] + first_columns + ['kindergartens', 'schools']]
     
     return districts
-
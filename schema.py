@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+# Типы элементов OSM (фиксированный словарь)
+ELEMENT_TYPES = pd.CategoricalDtype(['node', 'way', 'relation'])
+
+# Схема колонок датафреймов зданий и районов: одинаковые колонки во всех этапах имеют один тип
+# 'category' - словарь строится по данным (теги OSM и названия улиц не ограничены заранее),
+# CategoricalDtype - фиксированный словарь, целые с заглавной буквы - с пропусками (pd.NA)
+SCHEMA = {
+    'element_type': ELEMENT_TYPES,
+    'osmid': 'int64',
+    'building': 'category',
+    'amenity': 'category',
+    'landuse': 'category',
+    'residential': 'category',
+    'city': 'category',
+    'addr:street': 'category',
+    'street_type': 'category',
+    'building:levels': 'Int16',
+    'building:flats': 'Int32',
+    'element_type_landuse': ELEMENT_TYPES,
+    'osmid_landuse': 'Int64',
+    'district_id': 'Int32',
+    'points_row': 'int32',
+    'parkings': 'Int32',
+    'playgrounds': 'Int32',
+    'kindergartens': 'Int32',
+    'schools': 'Int32',
+    'people': 'Int32',
+    'landuse_people': 'category',
+    'match_confidence': 'float32'
+}
+
+
+# Функция для приведения числовой колонки к целому типу: дробные значения и значения вне диапазона типа - пропуски
+def to_integer(column: pd.Series, dtype: str) -> pd.Series:
+    
+    values = pd.to_numeric(column.astype(object), errors = 'coerce').astype('float64')
+    limits = np.iinfo(dtype.lower())
+    values = values.where((values == values.round()) & (values >= limits.min) & (values <= limits.max))
+    
+    return values.astype(dtype)
+
+# Функция для приведения колонок датафрейма к схеме (колонки, которых нет в схеме, не меняются)
+def apply_schema(df: pd.DataFrame, schema: dict = SCHEMA) -> pd.DataFrame:
+    
+    for column, dtype in schema.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        if isinstance(dtype, pd.CategoricalDtype) or dtype == 'category':
+            df[column] = df[column].astype(object).astype(dtype)
+        elif dtype.lower().startswith('int'):
+            df[column] = to_integer(df[column], dtype)
+        else:
+            df[column] = pd.to_numeric(df[column].astype(object), errors = 'coerce').astype(dtype)
+    
+    return df
+
+# Функция для проверки датафрейма на соответствие схеме, возвращает список нарушений (пустой - нарушений нет)
+def validate_schema(df: pd.DataFrame, schema: dict = SCHEMA) -> list:
+    
+    violations = []
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            if not isinstance(df[column].dtype, pd.CategoricalDtype):
+                violations.append(f'{column}: тип {df[column].dtype} вместо category')
+                continue
+            unknown = set(df[column].dropna().astype(object).unique()) - set(dtype.categories)
+            if len(unknown) > 0:
+                violations.append(f'{column}: значения вне словаря {sorted(unknown)}')
+            elif df[column].dtype != dtype:
+                violations.append(f'{column}: словарь {list(df[column].cat.categories)} вместо {list(dtype.categories)}')
+        elif df[column].dtype != dtype:
+            violations.append(f'{column}: тип {df[column].dtype} вместо {dtype}')
+    
+    return violations
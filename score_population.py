@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from model_registry import ModelRegistry
+from dataset_io import dataset_parts
+
+# Колонки, которые переносятся в результат для соединения с исходными зданиями
+KEY_COLUMNS = ['element_type', 'osmid']
+# Другие названия признаков во входных данных (в датасете конвейера площадь называется footprint_square)
+FEATURE_ALIASES = {'geometry_square': 'footprint_square'}
+
+CHUNK_SIZE = 50_000
+
+
+# Функция для чтения зданий чанками из JSONL (одна запись - одна строка)
+def read_jsonl_chunks(path: str, chunk_size: int):
+    
+    with pd.read_json(path, lines = True, chunksize = chunk_size, dtype = False) as reader:
+        for chunk in reader:
+            yield chunk
+
+# Функция для чтения зданий чанками из колоночного датасета (читаются только нужные колонки)
+def read_dataset_chunks(path: str, chunk_size: int, columns: list):
+    
+    for part in dataset_parts(path):
+        file = pq.ParquetFile(part)
+        part_columns = [column for column in columns if column in file.schema_arrow.names]
+        for batch in file.iter_batches(batch_size = chunk_size, columns = part_columns):
+            yield batch.to_pandas()
+
+# Функция для получения признаков модели по чанку зданий
+# Категории кодируются так же, как при обучении (cat.codes): значения вне словаря и пропуски получают -1
+def make_population_features(chunk: pd.DataFrame, feature_names: list, categories: dict) -> pd.DataFrame:
+    
+    features = pd.DataFrame(index = chunk.index)
+    for feature in feature_names:
+        column = feature[:-len('_code')] if feature.endswith('_code') else feature
+        if column not in chunk.columns and FEATURE_ALIASES.get(column) in chunk.columns:
+            column = FEATURE_ALIASES[column]
+    
+        if column in categories:
+            features[feature] = pd.Categorical(chunk[column].astype(object), categories = categories[column]).codes
+        else:
+            features[feature] = pd.to_numeric(chunk[column].astype(object), errors = 'coerce').astype('float64')
+    
+    return features
+
+# Функция для потоковой оценки численности населения зданий: чтение, кодирование и предсказание по чанкам
+# Память ограничена размером чанка, результат дописывается в output (JSONL) после каждого чанка
+def score_population(input_path: str, output_path: str, model_path: str, chunk_size: int = CHUNK_SIZE,
+                     thread_count: int = -1, verbose: bool = True) -> dict:
+    
+    model, metadata = ModelRegistry(thread_count).get(model_path, classifier = False)
+    feature_names = list(model.feature_names_)
+    categories = metadata.get('categories') or {}
+    
+    columns = KEY_COLUMNS + [feature[:-len('_code')] if feature.endswith('_code') else feature for feature in feature_names]
+    columns += [FEATURE_ALIASES[column] for column in columns if column in FEATURE_ALIASES]
+    if input_path.endswith('.jsonl') or input_path.endswith('.json'):
+        chunks = read_jsonl_chunks(input_path, chunk_size)
+    else:
+        chunks = read_dataset_chunks(input_path, chunk_size, columns)
+    
+    total, start = 0, time.perf_counter()
+    with open(output_path, 'w', encoding = 'utf-8') as output:
+        for i, chunk in enumerate(chunks, start = 1):
+            features = make_population_features(chunk, feature_names, categories)
+            pred = model.predict(features, thread_count = thread_count)
+    
+            result = chunk[[column for column in KEY_COLUMNS if column in chunk.columns]].copy()
+            result['people'] = np.round(pred, 2)
+            if len(result) > 0:
+                output.write(result.to_json(orient = 'records', lines = True, force_ascii = False).rstrip('\n') + '\n')
+    
+            total += len(chunk)
+            if verbose:
+                print(f'[{i}] обработано зданий: {total}, {total / (time.perf_counter() - start):.0f} зданий/с')
+    
+    elapsed = time.perf_counter() - start
+    stats = {'buildings': total, 'seconds': round(elapsed, 2), 'buildings_per_second': round(total / elapsed, 1) if elapsed > 0 else 0}
+    if verbose:
+        print(json.dumps(stats, ensure_ascii = False))
+    
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Потоковая оценка численности населения зданий')
+    parser.add_argument('input', help = 'здания: файл .jsonl или колоночный датасет (файл/папка parquet)')
+    parser.add_argument('output', help = 'файл результата (JSONL: element_type, osmid, people)')
+    parser.add_argument('--model', default = 'people_model.cbm', help = 'модель населения (рядом - метаданные с категориями)')
+    parser.add_argument('--chunk-size', type = int, default = CHUNK_SIZE)
+    parser.add_argument('--threads', type = int, default = -1)
+    parser.add_argument('--quiet', action = 'store_true')
+    args = parser.parse_args()
+    
+    if not os.path.exists(args.model):
+        sys.exit(f'Модель {args.model} не найдена')
+    score_population(args.input, args.output, args.model, args.chunk_size, args.threads, not args.quiet)
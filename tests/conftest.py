@@ -0,0 +1,54 @@
+import os
+import sys
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# модули репозитория лежат в корне, тесты запускаются из любой папки
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Локальный HTTP-сервер вместо внешнего API: respond(method, path, params) -> (статус, тип, тело)
+# Все запросы записываются в server.requests
+@pytest.fixture
+def stub_server():
+    
+    servers = []
+    
+    def start(respond):
+        requests_log = []
+        
+        class Handler(BaseHTTPRequestHandler):
+            def handle_request(self, method: str, params: dict) -> None:
+                path = urlparse(self.path).path
+                requests_log.append((method, path, params))
+                status, content_type, body = respond(method, path, params)
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self) -> None:
+                self.handle_request('GET', {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()})
+            
+            def do_POST(self) -> None:
+                data = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+                self.handle_request('POST', {k: v[0] for k, v in parse_qs(data).items()})
+            
+            def log_message(self, format, *args) -> None:
+                pass
+        
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.url = f'http://127.0.0.1:{server.server_address[1]}'
+        server.requests = requests_log
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        servers.append(server)
+        return server
+    
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
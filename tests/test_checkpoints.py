@@ -0,0 +1,23 @@
+import checkpoints
+from checkpoints import run_place_checkpointed
+from test_incremental import POLYGON, make_layers, mock_sources
+
+
+def test_warm_run_reads_only_final_stages(monkeypatch, tmp_path):
+    
+    mock_sources(monkeypatch, make_layers())
+    folder = str(tmp_path / 'checkpoints')
+    first = run_place_checkpointed('city', POLYGON, only_people = False, folder = folder)
+    
+    loaded = []
+    load_stage = checkpoints.load_stage
+    def recording_load_stage(folder, key, stage):
+        loaded.append(stage)
+        return load_stage(folder, key, stage)
+    monkeypatch.setattr(checkpoints, 'load_stage', recording_load_stage)
+    
+    second = run_place_checkpointed('city', POLYGON, only_people = False, folder = folder)
+    
+    assert loaded == ['frt_merge', 'dataset']
+    assert (second['points_inside'] != first['points_inside']).nnz == 0
+    assert list(second['buildings'].osmid) == list(first['buildings'].osmid)
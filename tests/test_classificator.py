@@ -0,0 +1,36 @@
+import geopandas as gpd
+from shapely.geometry import box
+from schema import apply_schema
+from classificator import classify_buildings
+
+
+def make_buildings() -> gpd.GeoDataFrame:
+    
+    return apply_schema(gpd.GeoDataFrame({
+        'element_type': ['way'] * 4,
+        'osmid': [1, 2, 3, 4],
+        'building': ['yes', 'yes', 'detached', 'yes'],
+        # значение вне диапазона Int32 и отсутствующее значение становятся пропусками
+        'building:flats': ['99999999999', None, '0', '24'],
+        'area_residential': [0.0, None, 0.0, 0.0],
+        'landuse': ['residential', None, 'rural', None],
+        'residential': ['apartments', None, None, None],
+        'amenity': [None, 'school', None, None]
+    }, geometry = [box(i, i, i + 1, i + 1) for i in range(4)], crs = 'EPSG:4326'))
+
+def test_missing_flats_do_not_match_rules():
+    
+    buildings = make_buildings()
+    assert buildings['building:flats'].isna().tolist() == [True, True, False, False]
+    
+    result = classify_buildings(buildings, only_people = False)
+    
+    assert list(result.building.astype(object)) == ['yes', 'school', 'house', 'apartments']
+
+def test_people_rules_with_missing_flats():
+    
+    result = classify_buildings(make_buildings(), only_people = True)
+    
+    assert list(result.osmid) == [1, 3, 4]
+    assert list(result.landuse.astype(object)[:2]) == ['urban', 'rural']
+    assert result.landuse.isna().tolist() == [False, False, True]
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box, Point
+import collector
+
+# Записанные ответы Overpass для тестового квартала
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# Статус сервера Overpass: пятая строка - число свободных слотов (osmnx не ждет перед запросом)
+OVERPASS_STATUS = 'Connected as: 1\nCurrent time: 2024-01-01T00:00:00Z\nAnnounced endpoint: none\nRate limit: 2\n2 slots available now.\n'
+
+
+# Ответ Overpass по всем тегам: у каждого объекта заполнены только колонки его тегов
+def make_features() -> gpd.GeoDataFrame:
+    
+    index = pd.MultiIndex.from_tuples([('way', 1), ('way', 2), ('node', 3)], names = ['element_type', 'osmid'])
+    return gpd.GeoDataFrame({
+        'building': ['house', 'apartments', None],
+        'building:levels': ['2', None, None],
+        'amenity': [None, None, 'school'],
+        'geometry': [box(0, 0, 1, 1), box(2, 2, 3, 3), Point(5, 5)]
+    }, index = index, crs = 'EPSG:4326')
+
+def test_single_query_makes_one_request(monkeypatch):
+    
+    calls = []
+    def fake_features_from_polygon(polygon, tags):
+        calls.append(tags)
+        return make_features()
+    monkeypatch.setattr(collector.ox, 'features_from_polygon', fake_features_from_polygon)
+    
+    layers = collector.fetch_layers_single_query(box(0, 0, 10, 10), collector.OSM_TAGS, verbose = False)
+    
+    assert len(calls) == 1
+    assert calls[0] == {tag: True for tag in collector.OSM_TAGS}
+    assert set(layers) == {'building', 'amenity'}
+    assert list(layers['building'].index.get_level_values('osmid')) == [1, 2]
+    assert 'amenity' not in layers['building'].columns
+    assert list(layers['amenity'].amenity) == ['school']
+    assert 'building:levels' not in layers['amenity'].columns
+
+def test_single_query_without_features_returns_no_layers(monkeypatch):
+    
+    def fake_features_from_polygon(polygon, tags):
+        raise collector.InsufficientResponseError('no data')
+    monkeypatch.setattr(collector.ox, 'features_from_polygon', fake_features_from_polygon)
+    
+    assert collector.fetch_layers_single_query(box(0, 0, 10, 10), collector.OSM_TAGS, verbose = False) == {}
+
+
+# Ответ Nominatim с заданным статусом
+class FakeResponse:
+    
+    def __init__(self, status_code: int, payload: list):
+        self.status_code = status_code
+        self.payload = payload
+    
+    def json(self) -> list:
+        return self.payload
+
+def mock_nominatim(monkeypatch, status_code: int = 200) -> tuple:
+    
+    requests_log, sleeps = [], []
+    def fake_get(url, params, timeout):
+        requests_log.append(params['q'])
+        return FakeResponse(status_code, [{'display_name': params['q'], 'geojson': {'type': 'Point', 'coordinates': [0, 0]}}])
+    monkeypatch.setattr(collector.session, 'get', fake_get)
+    monkeypatch.setattr(collector.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(collector, 'last_request_time', 0.0)
+    
+    return requests_log, sleeps
+
+def test_nominatim_repeated_lookup_is_cached(monkeypatch, tmp_path):
+    
+    requests_log, _ = mock_nominatim(monkeypatch)
+    
+    first = collector.get_polygons('Пермь', cache_folder = str(tmp_path))
+    second = collector.get_polygons('Пермь', cache_folder = str(tmp_path))
+    
+    assert requests_log == ['Пермь']
+    assert first == second
+    assert len(list(tmp_path.glob('*.json'))) == 1
+
+def test_nominatim_requests_are_rate_limited(monkeypatch, tmp_path):
+    
+    requests_log, sleeps = mock_nominatim(monkeypatch)
+    monkeypatch.setattr(collector, 'nominatim_interval', 60.0)
+    
+    collector.get_polygons('Пермь', cache_folder = str(tmp_path))
+    collector.get_polygons('Алапаевск', cache_folder = str(tmp_path))
+    
+    assert requests_log == ['Пермь', 'Алапаевск']
+    # перед вторым запросом выдерживается интервал после первого
+    assert len(sleeps) == 1 and 0 < sleeps[0] <= 60.0
+
+def test_nominatim_errors_are_not_cached(monkeypatch, tmp_path):
+    
+    requests_log, _ = mock_nominatim(monkeypatch, status_code = 429)
+    
+    assert collector.get_polygons('Пермь', cache_folder = str(tmp_path)) == {}
+    assert collector.get_polygons('Пермь', cache_folder = str(tmp_path)) == {}
+    assert len(requests_log) == 2
+    assert list(tmp_path.glob('*.json')) == []
+
+
+def test_city_outside_admin_boundaries_falls_back_to_overpass(monkeypatch, tmp_path):
+    
+    path = str(tmp_path / 'admin_boundaries.parquet')
+    gpd.GeoDataFrame({'name': ['Свердловская область', 'Екатеринбург'], 'kind': ['region', 'city']},
+                     geometry = [box(0, 0, 10, 10), box(1, 1, 2, 2)], crs = 'EPSG:4326').to_parquet(path)
+    
+    queries = []
+    class IsInResponse:
+        def json(self) -> dict:
+            return {'elements': [{'type': 'area', 'tags': {'admin_level': '4', 'name': 'Пермский край'}},
+                                 {'type': 'area', 'tags': {'place': 'city', 'name': 'Пермь'}}]}
+    def fake_get(url, timeout):
+        queries.append(url)
+        return IsInResponse()
+    monkeypatch.setattr(collector.requests, 'get', fake_get)
+    
+    assert collector.get_city_and_region_from_polygon(box(1.2, 1.2, 1.8, 1.8), boundaries = path) == ('Екатеринбург', 'Свердловская')
+    assert queries == []
+    assert collector.get_city_and_region_from_polygon(box(20, 20, 21, 21), boundaries = path) == ('Пермь', 'Пермский')
+    assert len(queries) == 1
+
+
+# Ответ локального Overpass: запрос дорог (фильтр highway) - граф дорог, остальные - объекты квартала
+def overpass_response(method: str, path: str, params: dict) -> tuple:
+    
+    if path.endswith('/status'):
+        return 200, 'text/plain', OVERPASS_STATUS
+    name = 'overpass_roads.json' if '"highway"' in params.get('data', '') else 'overpass_features.json'
+    with open(os.path.join(DATA_FOLDER, name), encoding = 'utf-8') as file:
+        return 200, 'application/json', file.read()
+
+def test_enrich_data_uses_local_overpass(stub_server, monkeypatch, tmp_path):
+    
+    server = stub_server(overpass_response)
+    monkeypatch.chdir(tmp_path)
+    default_endpoint = collector.ox.settings.overpass_url
+    context = collector.PipelineContext()
+    
+    buildings = collector.enrich_data(box(60.600, 56.830, 60.610, 56.840), verbose = False, only_people = False, cache = False,
+                                      overpass_endpoint = f'{server.url}/api', context = context)
+    
+    queries = [params['data'] for method, path, params in server.requests if path == '/api/interpreter']
+    # все теги - одним запросом, второй запрос - дороги для транспортных районов
+    assert len(queries) == 2
+    assert all(f"way['{tag}']" in queries[0] for tag in collector.OSM_TAGS)
+    assert '"highway"' in queries[1]
+    
+    assert list(buildings.osmid) == [100]
+    assert buildings.landuse.iloc[0] == 'residential'
+    assert buildings.district_id.notna().all()
+    assert len(context.transport_districts) == 2
+    assert sorted(collector.points_to_lists(context.points_inside, context.points_vocabulary)[0]) == ['bakery', 'cafe']
+    
+    # адрес сервера возвращается к прежнему, в том числе для ключей кэша
+    assert collector.ox.settings.overpass_url == default_endpoint
+    assert collector.data_source_key() == f'overpass:{default_endpoint}'
+
+
+# Ответ локального Nominatim: время запроса записывается, по названию 'Нигде' сервер отвечает ошибкой
+def make_nominatim_response(times: list):
+    
+    def respond(method: str, path: str, params: dict) -> tuple:
+        times.append(time.monotonic())
+        if params.get('q') == 'Нигде':
+            return 503, 'text/plain', 'Service Unavailable'
+        return 200, 'application/json', json.dumps([{'display_name': params['q'], 'class': 'boundary', 'type': 'administrative',
+                                                     'geojson': {'type': 'Point', 'coordinates': [56.25, 58.0]}}])
+    return respond
+
+def test_nominatim_server_cache_and_rate_limit(stub_server, monkeypatch, tmp_path):
+    
+    times = []
+    server = stub_server(make_nominatim_response(times))
+    monkeypatch.setattr(collector, 'nominatim_interval', 0.3)
+    base_url, cache_folder = f'{server.url}/search', str(tmp_path)
+    
+    first = collector.get_polygons('Пермь', base_url = base_url, cache_folder = cache_folder)
+    assert collector.get_polygons('Пермь', base_url = base_url, cache_folder = cache_folder) == first
+    collector.get_polygons('Алапаевск', base_url = base_url, cache_folder = cache_folder)
+    assert collector.get_polygons('Нигде', base_url = base_url, cache_folder = cache_folder) == {}
+    
+    assert first[0]['display_name'] == 'Пермь'
+    # повторный запрос - из кэша, ошибки не кэшируются
+    assert [(method, path, params['q']) for method, path, params in server.requests] == [
+        ('GET', '/search', 'Пермь'), ('GET', '/search', 'Алапаевск'), ('GET', '/search', 'Нигде')]
+    assert server.requests[0][2]['format'] == 'json' and server.requests[0][2]['polygon_geojson'] == '1'
+    assert len(list(tmp_path.glob('*.json'))) == 2
+    assert all(b - a >= 0.3 for a, b in zip(times, times[1:]))
+
+def test_nominatim_rate_limit_is_shared_between_threads(stub_server, monkeypatch, tmp_path):
+    
+    times = []
+    server = stub_server(make_nominatim_response(times))
+    monkeypatch.setattr(collector, 'nominatim_interval', 0.2)
+    places = ['Пермь', 'Алапаевск', 'Нижний Тагил', 'Верхняя Пышма']
+    
+    with ThreadPoolExecutor(max_workers = len(places)) as executor:
+        list(executor.map(lambda place: collector.get_polygons(place, base_url = f'{server.url}/search',
+                                                               cache_folder = str(tmp_path)), places))
+    
+    assert sorted(params['q'] for _, _, params in server.requests) == sorted(places)
+    times = sorted(times)
+    assert all(b - a >= 0.2 for a, b in zip(times, times[1:]))
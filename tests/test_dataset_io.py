@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from dataset_io import write_dataset, load_dataset, make_parquet_safe
+
+
+def make_buildings() -> gpd.GeoDataFrame:
+    
+    return gpd.GeoDataFrame({
+        'element_type': ['way', 'way', 'relation'],
+        'osmid': [1, 2, 3],
+        'building': ['house', 'apartments', None],
+        'building:flats': [None, '12', '99999999999'],
+        'addr:housenumber': ['1', 2, None],
+        'points_inside': [['shop', 'cafe'], [], ['school']],
+        'geometry': [box(0, 0, 1, 1), box(2, 2, 3, 3), box(4, 4, 5, 5)]
+    }, crs = 'EPSG:4326')
+
+def test_mixed_types_become_strings():
+    
+    frame = make_parquet_safe(make_buildings())
+    
+    assert list(frame['addr:housenumber'].iloc[:2]) == ['1', '2']
+    assert pd.isna(frame['addr:housenumber'].iloc[2])
+    assert list(frame.points_inside.iloc[0]) == ['shop', 'cafe']
+
+def test_written_dataset_can_be_written_again(tmp_path):
+    
+    folder = str(tmp_path / 'dataset')
+    write_dataset(make_buildings(), folder, 'city')
+    loaded = load_dataset(folder)
+    # после чтения списки - массивы numpy
+    assert isinstance(loaded.points_inside.iloc[0], np.ndarray)
+    
+    write_dataset(loaded, folder, 'city')
+    reloaded = load_dataset(folder)
+    
+    assert [list(x) for x in reloaded.points_inside] == [['shop', 'cafe'], [], ['school']]
+    assert list(reloaded.osmid) == [1, 2, 3]
+    assert reloaded['building:flats'].isna().tolist() == [True, False, True]
+    assert reloaded.geometry.equals(loaded.geometry)
@@ -0,0 +1,83 @@
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box, Point
+import collector
+import checkpoints
+import incremental
+from checkpoints import run_place_checkpointed, place_checkpoint_key, load_stage
+
+POLYGON = box(0, 0, 0.01, 0.01)
+CITY_REGION = ('Екатеринбург', 'Свердловская')
+
+
+# Слои OSM города: два здания, магазины внутри них и один район землепользования
+def make_layers() -> dict:
+    
+    buildings = gpd.GeoDataFrame({
+        'building': ['apartments', 'house'],
+        'addr:street': ['улица Ленина', 'улица Мира'],
+        'addr:housenumber': ['10', '2'],
+        'building:levels': ['9', '1'],
+        'geometry': [box(0.001, 0.001, 0.002, 0.002), box(0.005, 0.005, 0.006, 0.006)]
+    }, index = pd.MultiIndex.from_tuples([('way', 1), ('way', 2)], names = ['element_type', 'osmid']), crs = 'EPSG:4326')
+    shops = gpd.GeoDataFrame({
+        'shop': ['bakery', 'florist', 'kiosk'],
+        'geometry': [Point(0.0012, 0.0012), Point(0.0018, 0.0018), Point(0.0055, 0.0055)]
+    }, index = pd.MultiIndex.from_tuples([('node', 101), ('node', 102), ('node', 103)], names = ['element_type', 'osmid']),
+       crs = 'EPSG:4326')
+    landuse = gpd.GeoDataFrame({
+        'landuse': ['residential'], 'residential': ['apartments'], 'geometry': [box(0, 0, 0.01, 0.01)]
+    }, index = pd.MultiIndex.from_tuples([('way', 50)], names = ['element_type', 'osmid']), crs = 'EPSG:4326')
+    
+    return {'building': buildings, 'shop': shops, 'landuse': landuse}
+
+def mock_sources(monkeypatch, layers: dict) -> None:
+    
+    # Overpass: объекты слоев, пересекающиеся с запрошенным полигоном
+    def fake_fetch(polygon, tags, verbose):
+        return {tag: layer[layer.intersects(polygon)] for tag, layer in layers.items() if layer.intersects(polygon).any()}
+    def fake_districts(polygon, extract_path = None):
+        return gpd.GeoDataFrame({'district_id': [0]}, geometry = [POLYGON], crs = 'EPSG:4326')
+    def fake_frt(city_region, folder, store = None):
+        return pd.DataFrame({'addr:street': ['Ленина'], 'addr:housenumber': ['10'], 'floor_count_max': [9],
+                             'living_quarters_count': [36], 'area_residential': [1800.0]})
+    
+    monkeypatch.setattr(collector, 'fetch_layers_single_query', fake_fetch)
+    monkeypatch.setattr(checkpoints, 'fetch_layers_single_query', fake_fetch)
+    monkeypatch.setattr(collector, 'make_transport_districts', fake_districts)
+    for module in [checkpoints, incremental]:
+        monkeypatch.setattr(module, 'get_city_and_region_from_polygon', lambda polygon, boundaries = None: CITY_REGION)
+        monkeypatch.setattr(module, 'choose_frt_file', fake_frt)
+
+def test_osm_change_updates_stored_stages(monkeypatch, tmp_path):
+    
+    layers = make_layers()
+    mock_sources(monkeypatch, layers)
+    folder = str(tmp_path / 'checkpoints')
+    run_place_checkpointed('city', POLYGON, only_people = False, folder = folder)
+    
+    # в первом здании появляется кафе, второе здание удаляется
+    change_path = tmp_path / 'change.osc'
+    change_path.write_text(
+        '<osmChange version="0.6">'
+        '<create><node id="104" lat="0.0015" lon="0.0015"><tag k="shop" v="cafe"/></node></create>'
+        '<delete><way id="2"/></delete>'
+        '</osmChange>', encoding = 'utf-8')
+    layers['shop'] = pd.concat([layers['shop'], gpd.GeoDataFrame(
+        {'shop': ['cafe'], 'geometry': [Point(0.0015, 0.0015)]},
+        index = pd.MultiIndex.from_tuples([('node', 104)], names = ['element_type', 'osmid']), crs = 'EPSG:4326')])
+    layers['building'] = layers['building'].iloc[:1]
+    
+    result = incremental.apply_osm_change('city', POLYGON, str(change_path), only_people = False, folder = folder)
+    
+    assert list(zip(result['buildings'].element_type, result['buildings'].osmid)) == [('way', 1)]
+    
+    # этапы перечитываются с диска: в них те же изменения
+    key = place_checkpoint_key(POLYGON, False, 'frt_datasets')
+    enriched = load_stage(folder, key, 'enriched')
+    merged = load_stage(folder, key, 'frt_merge')
+    dataset = load_stage(folder, key, 'dataset')
+    building = merged['buildings'].iloc[0]
+    assert len(merged['buildings']) == 1
+    assert sorted(enriched['points_inside'].points_inside[building.points_row]) == ['bakery', 'cafe', 'florist']
+    assert len(dataset['districts']) == 1
@@ -0,0 +1,70 @@
+import os
+import json
+import pandas as pd
+import xml.etree.ElementTree as ET
+from shapely.geometry import box
+import collector
+import osm_extract
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+REGION = box(60.600, 56.830, 60.620, 56.840)
+
+
+# Выгрузка OSM (xml) из записанных ответов Overpass: квартал с дорогами и отдельное здание с забором, но без дорог
+def write_extract(path: str) -> str:
+    
+    elements = []
+    for name in ['overpass_features.json', 'overpass_roads.json']:
+        with open(os.path.join(DATA_FOLDER, name), encoding = 'utf-8') as file:
+            elements += json.load(file)['elements']
+    elements += [{'type': 'node', 'id': 41 + i, 'lon': lon, 'lat': lat}
+                 for i, (lon, lat) in enumerate([(60.615, 56.835), (60.616, 56.835), (60.616, 56.836), (60.615, 56.836)])]
+    elements += [{'type': 'way', 'id': 400, 'nodes': [41, 42, 43, 44, 41], 'tags': {'building': 'house'}},
+                 {'type': 'way', 'id': 401, 'nodes': [41, 43], 'tags': {'barrier': 'fence'}}]
+    
+    root = ET.Element('osm', version = '0.6')
+    for kind in ['node', 'way']:
+        for element in [e for e in elements if e['type'] == kind]:
+            item = ET.SubElement(root, kind, id = str(element['id']), version = '1')
+            if kind == 'node':
+                item.set('lat', str(element['lat']))
+                item.set('lon', str(element['lon']))
+            for ref in element.get('nodes', []):
+                ET.SubElement(item, 'nd', ref = str(ref))
+            for k, v in element.get('tags', {}).items():
+                ET.SubElement(item, 'tag', k = k, v = v)
+    ET.ElementTree(root).write(path, encoding = 'utf-8', xml_declaration = True)
+    
+    return path
+
+def test_tiled_run_reads_the_extract_once(monkeypatch, tmp_path):
+    
+    monkeypatch.chdir(tmp_path)
+    source = write_extract(str(tmp_path / 'region.osm'))
+    passes = []
+    iterate_osm_xml = osm_extract.iterate_osm_xml
+    def counting_iterate(path, handler):
+        passes.append(os.path.abspath(path))
+        return iterate_osm_xml(path, handler)
+    monkeypatch.setattr(osm_extract, 'iterate_osm_xml', counting_iterate)
+    
+    output = collector.enrich_data_tiled(REGION, str(tmp_path / 'region.csv'), tile_size_km = 0.5, verbose = False,
+                                         only_people = False, cache = False, extract_path = source)
+    
+    # выгрузка региона читается одним вырезанием (три прохода), тайлы читают только фрагмент региона
+    assert len(collector.make_grid(REGION, 0.5)) > 1
+    assert passes.count(source) == 3
+    buildings = pd.read_csv(output, sep = ';')
+    assert sorted(buildings.osmid) == [100, 400]
+    # у здания из тайла без дорог нет транспортного района
+    assert buildings.set_index('osmid').district_id.isna()[400]
+
+def test_fragment_without_roads_has_no_transport_districts(tmp_path, monkeypatch):
+    
+    monkeypatch.chdir(tmp_path)
+    source = write_extract(str(tmp_path / 'region.osm'))
+    
+    districts = collector.make_transport_districts(box(60.612, 56.832, 60.619, 56.839), extract_path = source)
+    
+    assert len(districts) == 0
+    assert not os.path.exists('transport_districts_cache')
@@ -0,0 +1,65 @@
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+import pipeline
+from pipeline import Pipeline
+
+
+def mock_frt(monkeypatch, load):
+    
+    monkeypatch.setattr(pipeline, 'choose_frt_file', lambda city_region, folder, store = None: load(city_region))
+    monkeypatch.setattr(pipeline, 'build_frt_address_index', lambda frt_data: {'frame': frt_data})
+
+def test_frt_index_is_built_once_per_city(monkeypatch):
+    
+    loads = []
+    release = threading.Event()
+    def load(city_region):
+        loads.append(city_region)
+        release.wait(5)
+        return city_region[0]
+    mock_frt(monkeypatch, load)
+    runner = Pipeline()
+    
+    with ThreadPoolExecutor(max_workers = 4) as executor:
+        futures = [executor.submit(runner.frt_index, ('Пермь', 'Пермский')) for _ in range(4)]
+        release.set()
+        indexes = [future.result() for future in futures]
+    
+    assert loads == [('Пермь', 'Пермский')]
+    assert all(index is indexes[0] for index in indexes)
+
+def test_loading_one_city_does_not_block_another(monkeypatch):
+    
+    other_started = threading.Event()
+    def load(city_region):
+        # первый город ждет, пока начнется загрузка второго (с общей блокировкой не дождался бы)
+        if city_region[0] == 'Пермь':
+            assert other_started.wait(5)
+        else:
+            other_started.set()
+        return city_region[0]
+    mock_frt(monkeypatch, load)
+    runner = Pipeline()
+    
+    with ThreadPoolExecutor(max_workers = 2) as executor:
+        slow = executor.submit(runner.frt_index, ('Пермь', 'Пермский'))
+        fast = executor.submit(runner.frt_index, ('Екатеринбург', 'Свердловская'))
+        assert fast.result(timeout = 5) == {'frame': 'Екатеринбург'}
+        assert slow.result(timeout = 5) == {'frame': 'Пермь'}
+
+def test_failed_load_is_retried(monkeypatch):
+    
+    attempts = []
+    def load(city_region):
+        attempts.append(city_region)
+        if len(attempts) == 1:
+            raise FileNotFoundError('нет файла региона')
+        return city_region[0]
+    mock_frt(monkeypatch, load)
+    runner = Pipeline()
+    
+    with pytest.raises(FileNotFoundError):
+        runner.frt_index(('Пермь', 'Пермский'))
+    assert runner.frt_index(('Пермь', 'Пермский')) == {'frame': 'Пермь'}
+    assert len(attempts) == 2
@@ -0,0 +1,41 @@
+import optuna
+import pytest
+from types import SimpleNamespace
+from tuning import PruningCallback
+
+
+# Испытание, которое запоминает промежуточные значения и останавливается после заданного шага
+class FakeTrial:
+    
+    def __init__(self, prune_after: int = None):
+        self.reports = {}
+        self.prune_after = prune_after
+    
+    def report(self, value: float, step: int) -> None:
+        self.reports[step] = value
+    
+    def should_prune(self) -> bool:
+        return self.prune_after is not None and max(self.reports) >= self.prune_after
+
+def iteration(i: int) -> SimpleNamespace:
+    return SimpleNamespace(iteration = i, metrics = {'validation': {'R2': [i / 1000]}})
+
+def test_metric_is_reported_every_interval():
+    
+    trial = FakeTrial()
+    callback = PruningCallback(trial, 'R2', interval = 50)
+    
+    assert all(callback.after_iteration(iteration(i)) for i in range(1, 1051))
+    assert sorted(trial.reports) == list(range(0, 1050, 50))
+    assert trial.reports[100] == 0.101
+    callback.check_pruned()
+
+def test_pruned_trial_stops_training():
+    
+    callback = PruningCallback(FakeTrial(prune_after = 100), 'R2', interval = 50)
+    
+    stopped = [i for i in range(1, 300) if not callback.after_iteration(iteration(i))]
+    
+    assert stopped[0] == 101
+    with pytest.raises(optuna.TrialPruned):
+        callback.check_pruned()
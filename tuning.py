@@ -0,0 +1,121 @@
+import optuna
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from catboost import CatBoostRegressor, Pool
+from sklearn.metrics import r2_score
+
+# Файл хранилища исследований (SQLite): испытания общие для всех процессов и сохраняются между запусками
+STORAGE = 'tuning.db'
+
+# Число итераций без улучшения на отложенной выборке, после которого обучение модели останавливается
+EARLY_STOPPING_ROUNDS = 50
+# Интервал (в итерациях бустинга) между промежуточными значениями метрики: каждое значение - запись в общее хранилище
+REPORT_INTERVAL = 50
+
+
+# Callback CatBoost для остановки неперспективных испытаний: метрика на отложенной выборке передается в Optuna
+# не на каждой итерации, а раз в interval итераций (шаги 0, interval, 2 * interval, ... совпадают с interval_steps прунера)
+class PruningCallback:
+    
+    def __init__(self, trial: optuna.Trial, metric: str, interval: int = REPORT_INTERVAL):
+        self.trial = trial
+        self.metric = metric
+        self.interval = interval
+        self.pruned_step = None
+    
+    # вызывается CatBoost после каждой итерации, False останавливает обучение
+    def after_iteration(self, info) -> bool:
+        
+        step = info.iteration - 1
+        if step % self.interval != 0:
+            return True
+        
+        self.trial.report(info.metrics['validation'][self.metric][-1], step = step)
+        if self.trial.should_prune():
+            self.pruned_step = step
+            return False
+        return True
+    
+    # исключение Optuna для остановленного испытания (внутри callback CatBoost его выбросить нельзя)
+    def check_pruned(self) -> None:
+        if self.pruned_step is not None:
+            raise optuna.TrialPruned(f'Trial was pruned at iteration {self.pruned_step}.')
+
+# Функция для получения хранилища исследований
+# Ожидание блокировки SQLite увеличено, т.к. в файл одновременно пишут несколько процессов
+def make_storage(path: str = STORAGE) -> optuna.storages.RDBStorage:
+    return optuna.storages.RDBStorage(f'sqlite:///{path}', engine_kwargs = {'connect_args': {'timeout': 60}})
+
+# Функция для создания исследования или продолжения уже сохраненного с тем же названием
+# Испытания с плохими промежуточными значениями метрики останавливаются (MedianPruner)
+def load_study(study_name: str, storage: str = STORAGE) -> optuna.Study:
+    
+    pruner = optuna.pruners.MedianPruner(n_warmup_steps = 100, interval_steps = REPORT_INTERVAL)
+    return optuna.create_study(study_name = study_name, storage = make_storage(storage), load_if_exists = True,
+                               direction = 'maximize', pruner = pruner)
+
+# Функция, создающая целевую функцию Optuna для CatBoostRegressor
+# Выборки переводятся в Pool один раз и переиспользуются всеми испытаниями процесса
+def make_catboost_objective(X_train: pd.DataFrame, y_train: pd.Series, X_test: pd.DataFrame, y_test: pd.Series,
+                            thread_count: int = -1):
+    
+    train_pool = Pool(X_train, y_train)
+    test_pool = Pool(X_test, y_test)
+    
+    def objective(trial: optuna.Trial) -> float:
+        params = {}
+        params['learning_rate'] = trial.suggest_float('learning_rate', low = 0.001, high = 0.003, step = 0.001)
+        params['n_estimators'] = trial.suggest_int('n_estimators', low = 1030, high = 1070, step = 5)
+        params['depth'] = trial.suggest_int('depth', low = 6, high = 10, step = 1)
+    
+        # промежуточные значения - та же метрика, что и цель исследования (R2, чем больше, тем лучше)
+        pruning_callback = PruningCallback(trial, 'R2')
+        model = CatBoostRegressor(**params, eval_metric = 'R2', thread_count = thread_count, verbose = 0)
+        model.fit(train_pool, eval_set = test_pool, early_stopping_rounds = EARLY_STOPPING_ROUNDS,
+                  callbacks = [pruning_callback])
+        pruning_callback.check_pruned()
+    
+        trial.set_user_attr('best_iteration', int(model.get_best_iteration()))
+        return r2_score(y_test, model.predict(test_pool))
+    
+    return objective
+
+# Функция для одного процесса-исполнителя: подключается к общему исследованию и выполняет свою часть испытаний
+def run_worker(study_name: str, storage: str, n_trials: int, X_train: pd.DataFrame, y_train: pd.Series,
+               X_test: pd.DataFrame, y_test: pd.Series, thread_count: int = 1) -> int:
+    
+    study = load_study(study_name, storage)
+    study.optimize(make_catboost_objective(X_train, y_train, X_test, y_test, thread_count), n_trials = n_trials)
+    
+    return n_trials
+
+# Функция для подбора гиперпараметров CatBoostRegressor в нескольких процессах
+# n_trials - общее число испытаний исследования: после прерывания запуск продолжает с уже выполненных испытаний
+def tune_catboost(X_train: pd.DataFrame, y_train: pd.Series, X_test: pd.DataFrame, y_test: pd.Series,
+                  study_name: str, storage: str = STORAGE, n_trials: int = 50, n_workers: int = 4) -> optuna.Study:
+    
+    study = load_study(study_name, storage)
+    finished = [trial for trial in study.trials if trial.state in [optuna.trial.TrialState.COMPLETE,
+                                                                   optuna.trial.TrialState.PRUNED]]
+    remaining = max(n_trials - len(finished), 0)
+    if remaining == 0:
+        return study
+    
+    # испытания делятся между процессами поровну, каждый процесс обучает модели в один поток
+    shares = [len(share) for share in np.array_split(np.arange(remaining), n_workers) if len(share) > 0]
+    with ProcessPoolExecutor(max_workers = len(shares)) as executor:
+        futures = [executor.submit(run_worker, study_name, storage, share, X_train, y_train, X_test, y_test)
+                   for share in shares]
+        for future in futures:
+            future.result()
+    
+    return load_study(study_name, storage)
+
+# Функция для получения параметров лучшей модели: число деревьев - до лучшей итерации на отложенной выборке
+def best_catboost_params(study: optuna.Study) -> dict:
+    
+    params = dict(study.best_params)
+    params['n_estimators'] = study.best_trial.user_attrs.get('best_iteration', params['n_estimators'] - 1) + 1
+    
+    return params
@@ -1,3 +1,12 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from functools import lru_cache
+from typing import Union
+from urllib.parse import unquote
+from schema import apply_schema
+
 # Функция, проверяющая, является ли список частью другого списка
 def is_sublist(sub: list, main: list) -> bool:
     return all(elem in main for elem in sub)
@@ -10,6 +19,60 @@ def check_nan(obj):
 def keep_only_numbers(input_string: str) -> str:
     return ''.join(char for char in input_string if char.isdigit())
 
+# Верхняя граница числа этажей/квартир при разборе
+LEVELS_LIMIT = np.iinfo(np.int64).max
+
+# Функция для получения корректного числа этажей в здании (также используется для коррекции квартир в здании)
+def validate_levels(levels: Union[str, float]) -> int:
+    
+    if check_nan(levels):
+        levels = 0
+        
+    if isinstance(levels, str):
+        if levels.isnumeric():
+            levels = int(levels)
+        elif any([';' in levels, '-' in levels, ', ' in levels]):
+            levels = levels.replace(';', '*').replace('-', '*').replace(', ', '*')
+            levels = levels.split('*')
+            if '' in levels:
+                levels.remove('')
+            levels = list(map(lambda x: int(keep_only_numbers(x)), levels))
+            levels = int(round(np.mean(levels), 0))
+        elif any([',' in levels, '.' in levels]):
+            levels = levels.replace(',', '.')
+            levels = int(round(float(levels), 0))
+        else:
+            levels = keep_only_numbers(levels)
+            if levels == '':
+                levels = 1
+            levels = int(levels)
+            
+    if isinstance(levels, float):
+        levels = int(round(levels, 0))
+        
+    return levels
+
+# Функция для разбора колонки этажей/квартир целиком (вместо validate_levels для каждого элемента)
+# Каждое уникальное значение разбирается один раз, чисто числовые строки - одним регулярным выражением
+def parse_levels(values: Union[pd.Series, list], na_value: float = 0) -> np.ndarray:
+    
+    codes, uniques = pd.factorize(pd.Series(values, dtype = object))
+    uniques = pd.Series(uniques, dtype = object)
+    
+    # значения больше int64 (ошибки ввода вида '99999999999999999999') ограничиваются сверху, а не переполняются
+    parsed = np.zeros(len(uniques), dtype = np.int64)
+    is_digits = uniques.apply(lambda x: isinstance(x, str)) & uniques.astype(str).str.fullmatch(r'\d+')
+    parsed[is_digits.values] = [min(int(x), LEVELS_LIMIT) for x in uniques[is_digits]]
+    parsed[~is_digits.values] = [min(validate_levels(x), LEVELS_LIMIT) for x in uniques[~is_digits]]
+    
+    # пропуски получают код -1, т.е. последний элемент
+    if np.isnan(na_value):
+        parsed = np.append(parsed.astype(np.float64), na_value)
+    else:
+        parsed = np.append(parsed, np.int64(na_value))
+    
+    return parsed[codes]
+
 # Функция, делающая из вложенного списка одномерный 
 def flatten_list(nested_list):
     
@@ -22,17 +85,59 @@ def flatten_list(nested_list):
             
     return flat_list
 
-# Функция для выбора определенного файла ФРТ
-def choose_frt_file(city_region: tuple, folder: str) -> pd.DataFrame:
+# Колонки ФРТ, которые нужны для соединения с OSM
+FRT_COLUMNS = ['formalname_street', 'house_number', 'building', 'block', 'letter',
+               'floor_count_max', 'living_quarters_count', 'area_residential']
+
+# Функция для однократной конвертации csv ФРТ в колоночное хранилище (parquet), разбитое по региону и городу
+# Числовые колонки приводятся к числам при конвертации (в area_residential десятичная запятая)
+def build_frt_store(folder: str, store: str) -> str:
+    
+    for file in sorted(os.listdir(folder)):
+        if not file.endswith('.csv'):
+            continue
+        frt_data = pd.read_csv(os.path.join(folder, file), sep = ',', low_memory = False, dtype = str)
+        frt_data = frt_data[frt_data.formalname_city.notna()]
+        
+        frt_data['area_residential'] = pd.to_numeric(
+            frt_data['area_residential'].str.replace(',', '.'), errors = 'coerce')
+        for column in ['floor_count_max', 'floor_count_min', 'living_quarters_count']:
+            frt_data[column] = pd.to_numeric(frt_data[column], errors = 'coerce').astype('float32')
+        
+        frt_data.to_parquet(store, partition_cols = ['formalname_region', 'formalname_city'], index = False,
+                          existing_data_behavior = 'delete_matching')
+        
+    return store
+
+# Функция для чтения из хранилища ФРТ только раздела и колонок нужного города
+def read_frt_store(city_region: tuple, store: str, columns: list = FRT_COLUMNS) -> pd.DataFrame:
     
     city_name = city_region[0]
     region_name = city_region[1]
-    files = os.listdir(folder)
-     
-    region_csv = str([file for file in files if region_name in file][0])
+    
+    # значения разделов в именах папок закодированы как в url
+    regions = {unquote(name.split('=', 1)[1]): name for name in os.listdir(store) if name.startswith('formalname_region=')}
+    region_dir = [regions[region] for region in regions if region_name in region][0]
+    
+    frt_data = pd.read_parquet(f'{store}/{region_dir}', columns = columns,
+                               filters = [('formalname_city', '==', city_name)])
+    return frt_data
 
-    frt_data = pd.read_csv(f'./{folder}/{region_csv}', sep = ',', low_memory = False)
-    frt_data = frt_data[frt_data.formalname_city == city_name]
+# Функция для выбора определенного файла ФРТ
+# Если передано хранилище (build_frt_store), читается только раздел города, иначе весь csv региона
+def choose_frt_file(city_region: tuple, folder: str, store: str = None) -> pd.DataFrame:
+    
+    city_name = city_region[0]
+    region_name = city_region[1]
+    
+    if store is not None and os.path.exists(store):
+        frt_data = read_frt_store(city_region, store)
+    else:
+        files = os.listdir(folder)
+        region_csv = str([file for file in files if region_name in file][0])
+        
+        frt_data = pd.read_csv(f'./{folder}/{region_csv}', sep = ',', low_memory = False)
+        frt_data = frt_data[frt_data.formalname_city == city_name]
     
     changes = {'formalname_street' : 'addr:street', 'house_number' : 'addr:housenumber', 'building' : 'building_index'}
     frt_data = frt_data.rename(columns = changes)
@@ -43,75 +148,149 @@ def remove_shortnames(shortname: str, x: list) -> str:
     result = next((item for item in x if shortname in str(item)), '')
     return result.replace(shortname, '')
 
+# Сокращения типов улиц
+STREET_TYPES = {'пер' : 'переулок', 'ул' : 'улица', 'мкр' : 'микрорайон', 'пл' : 'площадь',
+                'тер' : 'территория', 'пр-кт' : 'проспект', 'пр' : 'проспект', 'пр-д' : 'проезд'}
+
+# Функция, разбирающая улицу на название и тип (результат кэшируется, т.к. улицы сильно повторяются)
+@lru_cache(maxsize = 100000)
+def parse_street(street: str) -> tuple:
+    
+    #удаление лишних пробелов
+    street = ' '.join(street.split()).replace('ё', 'е')
+    if street == '-':
+        return '', '-'
+    
+    words = street.split(' ')
+    types = [word for word in words if word[:1].islower()]
+    name = ' '.join([word for word in words if word not in types])
+    
+    street_type = '-' if len(types) == 0 else types[0].replace('.', '')
+    street_type = STREET_TYPES.get(street_type, street_type)
+    
+    return name, street_type
+
+# Функция, разбирающая номер дома на номер, корпус, строение и литеру (результат кэшируется)
+@lru_cache(maxsize = 100000)
+def parse_housenumber(housenumber: str) -> tuple:
+    
+    if housenumber == '-':
+        return '-', '', '', ''
+    
+    parts = housenumber.split(' ')
+    return parts[0], remove_shortnames('к', parts), remove_shortnames('с', parts), remove_shortnames('лит', parts)
+
+# Функция, разбирающая каждое уникальное значение колонки один раз и раскладывающая результат по строкам через коды
+def parse_unique(column: pd.Series, parser, fields: list) -> pd.DataFrame:
+    
+    codes, uniques = pd.factorize(column.astype(object).fillna('-'))
+    parsed = pd.DataFrame([parser(value) for value in uniques], columns = fields, dtype = object)
+    parsed = parsed.take(codes).set_axis(column.index)
+    
+    return parsed
+
 # Функция, модифицирующая адрес для соединения
 def modify_address_to_join(df: pd.DataFrame) -> pd.DataFrame:
-        
-    df['addr:street'] = df['addr:street'].fillna('-')
-    #удаление лишних пробелов
-    df['addr:street'] = df['addr:street'].apply(lambda x: ' '.join(x.split()))
-    df['addr:street'] = df['addr:street'].str.replace('ё', 'е')
-    df['addr:street'] = df['addr:street'].apply(lambda x: x.split(' ') if x != '-' else x)
-    df['street_type'] = df['addr:street'].progress_apply(
-        lambda x: x if x == '-' else [elem for elem in x if elem[0].islower()]
-    )
     
-    df['addr:street'] = df.apply(lambda row: 
-        [item for item in row['addr:street'] if item not in row['street_type']], axis = 1
-    )
-    df['street_type'] = df['street_type'].apply(lambda x: '-' if check_nan(x) or len(x) == 0 else x[0])
-    df['addr:street'] = df['addr:street'].apply(lambda x: " ".join(x))
-    changes = {'пер' : 'переулок', 'ул' : 'улица', 'мкр' : 'микрорайон', 'пл' : 'площадь',
-               'тер' : 'территория', 'пр-кт' : 'проспект', 'пр' : 'проспект', 'пр-д' : 'проезд'}
+    street = parse_unique(df['addr:street'], parse_street, ['addr:street', 'street_type'])
+    df['addr:street'] = street['addr:street']
+    df['street_type'] = street['street_type']
     
-    df['street_type'] = df['street_type'].apply(lambda x: x.replace('.', ''))
-    df['street_type'] = df['street_type'].apply(lambda x: changes[x] if x in changes.keys() else x)
+    housenumber = parse_unique(df['addr:housenumber'], parse_housenumber, ['number', 'block', 'building_index', 'letter'])
+    df = df.drop(columns = ['addr:housenumber'])
+    df['addr:housenumber'] = housenumber['number']
+    df['block'] = housenumber['block']
+    df['building_index'] = housenumber['building_index']
     
-    df['addr:housenumber'] = df['addr:housenumber'].fillna('-')
-    df['addr:housenumber'] = df['addr:housenumber'].apply(lambda x: x.split(' ') if x != '-' else x)
-    df['number'] = df['addr:housenumber'].apply(lambda x: x[0])
-    df['block'] = df['addr:housenumber'].apply(lambda x: remove_shortnames('к', x))
-    df['building_index'] = df['addr:housenumber'].apply(lambda x: remove_shortnames('с', x))
-    df['letter'] = df['addr:housenumber'].apply(lambda x: remove_shortnames('лит', x))
+    # литера нужна, только если по адресу (улица, номер, корпус) несколько зданий
+    num_indexes = df.groupby(['addr:street', 'addr:housenumber', 'block'])['block'].transform('size')
+    df['letter'] = housenumber['letter'].where(num_indexes != 1, '')
     
-    df['num_indexes'] = df.groupby(['addr:street', 'number', 'block'])['letter'].transform('count')
-    df['letter'] = df.apply(lambda row: '' if row['num_indexes'] == 1.0 else row['letter'], axis = 1)
+    return apply_schema(df)
+
+# Функция, возвращающая множество триграмм строки
+def trigrams(text: str) -> set:
+    text = f'  {text.lower()} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# Функция для построения индекса адресов ФРТ (строится один раз на город)
+# exact - позиция строки ФРТ по (улица, номер дома), by_number - улицы с триграммами для каждого номера дома
+def build_frt_address_index(df_frt: pd.DataFrame) -> dict:
+    
+    merge_on = ['addr:street', 'addr:housenumber']
+    cols = merge_on + ['floor_count_max', 'living_quarters_count', 'area_residential']
     
-    df.drop(columns = ['addr:housenumber', 'num_indexes'], inplace = True)
-    df.rename(columns = {'number' : 'addr:housenumber'}, inplace = True)
+    # из повторяющихся адресов ФРТ берется первый, как раньше после drop_duplicates
+    frame = df_frt[cols].dropna(subset = merge_on).drop_duplicates(subset = merge_on).reset_index(drop = True)
+    keys = list(zip(frame['addr:street'].astype(str), frame['addr:housenumber'].astype(str)))
+    exact = {key: i for i, key in enumerate(keys)}
     
-    return df
+    by_number = {}
+    for (street, number), i in exact.items():
+        by_number.setdefault(number, []).append((trigrams(street), i))
+    
+    return {'frame': frame.drop(columns = merge_on), 'exact': exact, 'by_number': by_number}
+
+# Функция для поиска адреса в индексе ФРТ: точное совпадение, затем нечеткое среди улиц с тем же номером дома
+# Возвращает позицию строки ФРТ (-1, если не найдено) и уверенность совпадения
+def match_address(street: str, number: str, frt_index: dict, fuzzy: bool, min_similarity: float) -> tuple:
+    
+    position = frt_index['exact'].get((street, number))
+    if position is not None:
+        return position, 1.0
+    if not fuzzy or street in ['', '-'] or number == '-':
+        return -1, np.nan
+    
+    query = trigrams(street)
+    best_position, best_similarity = -1, 0.0
+    for candidate, i in frt_index['by_number'].get(number, []):
+        similarity = len(query & candidate) / len(query | candidate)
+        if similarity > best_similarity:
+            best_position, best_similarity = i, similarity
+    
+    if best_similarity < min_similarity:
+        return -1, np.nan
+    return best_position, round(best_similarity, 3)
 
 # Функция, соединяющая данные из ФРТ и OSM
-def merge_osm_frt(df_osm: pd.DataFrame, df_frt: pd.DataFrame) -> pd.DataFrame:
-        
-    cols = ['addr:street', 'addr:housenumber', 'building_index', 
-            'block', 'letter', 'floor_count_max', 'living_quarters_count', 'area_residential']
+# Каждый уникальный адрес ищется в индексе один раз, каждое здание получает не больше одной строки ФРТ
+def merge_osm_frt(df_osm: pd.DataFrame, df_frt: pd.DataFrame, fuzzy: bool = True, min_similarity: float = 0.5,
+                  frt_index: dict = None) -> pd.DataFrame:
     
-    merge_on = ['addr:street', 'addr:housenumber']
-    df_osm = df_osm.merge(df_frt[cols], how = 'left', on = merge_on)
+    if frt_index is None:
+        frt_index = build_frt_address_index(df_frt)
+    
+    df_osm = df_osm.reset_index(drop = True)
+    addresses = pd.Series(list(zip(df_osm['addr:street'].astype(str), df_osm['addr:housenumber'].astype(str))),
+                          index = df_osm.index, dtype = object)
+    codes, uniques = pd.factorize(addresses)
+    matches = [match_address(street, number, frt_index, fuzzy, min_similarity) for street, number in uniques]
+    positions = np.array([match[0] for match in matches], dtype = np.int64)[codes]
+    confidence = np.array([match[1] for match in matches], dtype = np.float64)[codes]
+    
+    frt_values = frt_index['frame'].reindex(positions).set_axis(df_osm.index)
+    df_osm = pd.concat([df_osm, frt_values], axis = 1)
+    df_osm['match_confidence'] = confidence
     
-    df_osm['floor_count_max'] = df_osm.apply(
-        lambda row: row['building:levels'] if check_nan(row['floor_count_max']) else row['floor_count_max'], axis = 1)
-    df_osm['floor_count_max'] = df_osm.apply(
-        lambda row: 1 if row['building'] == 'house' else row['floor_count_max'], axis = 1)
-    df_osm['floor_count_max'] = [validate_levels(l) if not check_nan(l) else l for l in df_osm['floor_count_max']]
+    # колонки схемы (nullable int, category) переводятся в object, чтобы в них можно было подставить значения ФРТ
+    levels = df_osm['building:levels'].astype(object)
+    floor_count = df_osm['floor_count_max'].astype(object).where(df_osm['floor_count_max'].notna(), levels)
+    floor_count = floor_count.mask(df_osm['building'] == 'house', 1)
+    df_osm['floor_count_max'] = parse_levels(floor_count, na_value = np.nan)
     df_osm.drop_duplicates(subset = ['element_type', 'osmid'], inplace = True)
     
-    df_osm['building:levels'] = df_osm.apply(
-        lambda row: row['building:levels'] if not check_nan(row['building:levels']) else row['floor_count_max'], axis = 1
-    )
-    df_osm['building:flats'] = df_osm.apply(
-        lambda row: row['building:flats'] if check_nan(row['living_quarters_count']) or row['living_quarters_count'] == 0 
-        else row['living_quarters_count'], axis = 1
-    )
+    df_osm['building:levels'] = df_osm['building:levels'].astype(object).where(
+        df_osm['building:levels'].notna(), df_osm['floor_count_max'])
+    living = df_osm['living_quarters_count']
+    df_osm['building:flats'] = df_osm['building:flats'].astype(object).where(
+        living.isna() | (living == 0), living)
     df_osm.drop(columns = ['living_quarters_count', 'floor_count_max'], inplace = True)
-    df_osm.rename(columns = {'block_x': 'block', 'building_index_y': 'building_index', 'letter_y':'letter'}, inplace = True)
     
     df_osm['building:flats'] = df_osm['building:flats'].replace('?', 1)
     df_osm['area_residential'] = df_osm['area_residential'].replace('', 0)
     
-    df_osm = df_osm[~df_osm.osmid.apply(check_nan)]
-    df_osm.osmid = df_osm.osmid.apply(lambda x: str(x).replace('.0', ''))
+    df_osm = df_osm[df_osm.osmid.notna()]
+    df_osm.osmid = pd.to_numeric(df_osm.osmid).astype(np.int64)
     
     df_osm['area_residential'] = df_osm['area_residential'].apply(
         lambda x: x if type(x) == float else float(x.replace(',', '.')))
@@ -119,70 +298,40 @@ def merge_osm_frt(df_osm: pd.DataFrame, df_frt: pd.DataFrame) -> pd.DataFrame:
     cols = [column for column in df_osm.columns if all(['index' not in column, 'letter' not in column, 'block' not in column])]
     df_osm = df_osm[cols]
     
-    return df_osm
+    return apply_schema(df_osm)
 
 # Функция для выделения признаков сформированных районов
+# Статистики зданий считаются групповыми агрегатами по ключу района, геометрия берется из таблицы районов без перевода в WKT
 def extract_districts_features(main_df: gpd.GeoDataFrame, district_df: gpd.GeoDataFrame, groupby: Union[list, str]) -> gpd.GeoDataFrame:
     
-    tmp = main_df.copy()
-    cols = ['building', 'building:levels', 'footprint_square']
+    keys = [groupby] if type(groupby) == str else groupby
     
-    if type(groupby) == str:
-        cols += [groupby]
-    else:
-        cols += groupby
+    buildings = main_df[keys + ['building']].copy()
+    buildings['building:levels'] = pd.to_numeric(main_df['building:levels'], errors = 'coerce')
+    buildings['footprint_square'] = pd.to_numeric(main_df['footprint_square'], errors = 'coerce')
+    buildings['apartments_number'] = main_df['building'].astype(str).str.contains('apartments') & main_df['building'].notna()
     
-    tmp = district_df.merge(tmp[cols], on = groupby, how = 'right')
-    tmp['geometry'] = tmp.geometry.apply(lambda x: str(x))
+    stats = buildings.groupby(keys, observed = True).agg(
+        median_levels = ('building:levels', 'median'),
+        median_footprint_square = ('footprint_square', 'median'),
+        total_buildings = ('building', 'count'),
+        apartments_number = ('apartments_number', 'sum')
+    )
     
+    district_columns = ['geometry', 'parkings', 'playgrounds', 'kindergartens', 'schools', 'district_square_km2']
     if type(groupby) == list:
-        landuse = pd.DataFrame(
-            tmp.groupby(groupby).agg(
-                landuse = ('landuse', 'first'),
-                residential = ('residential', 'first')
-            )
-        ).reset_index().drop(columns = ['osmid_landuse', 'element_type_landuse'])
-
-    tmp = gpd.GeoDataFrame(
-        tmp.groupby(groupby).agg(
-            geometry = ('geometry', 'first'),
-            parkings = ('parkings', 'first'),
-            playgrounds = ('playgrounds', 'first'),
-            kindergartens = ('kindergartens', 'first'),
-            schools = ('schools', 'first'),
-            district_square_km2 = ('district_square_km2', 'first'),
-            median_levels = ('building:levels', np.median),
-            median_footprint_square = ('footprint_square', np.median),
-            total_buildings = ('building', 'count'),
-            apartments_number = ('building', lambda x: x.str.contains('apartments').sum())
-        )
-    ).reset_index()
+        district_columns += ['landuse', 'residential']
+    districts = pd.DataFrame(district_df).drop_duplicates(subset = keys).set_index(keys)[district_columns]
     
-    if type(groupby) == list:
-        tmp = pd.concat([tmp, landuse], axis = 1)
+    tmp = stats.join(districts, how = 'left').reset_index()
+    tmp = gpd.GeoDataFrame(tmp, geometry = 'geometry', crs = 'EPSG:4326')
     
-    tmp.geometry = tmp.geometry.apply(lambda x: wkt.loads(x))
-    tmp = gpd.GeoDataFrame(tmp).set_geometry('geometry').set_crs('EPSG:4326')
+    square = tmp['district_square_km2']
+    tmp['building_density'] = (tmp['total_buildings'] / square.replace(0, np.nan)).mask(square == 0, -1)
+    tmp['median_levels'] = tmp['median_levels'].fillna(0)
+    tmp['apartments_rate'] = (tmp['apartments_number'] / tmp['total_buildings'].replace(0, np.nan)).round(2).fillna(0)
     
-    tmp['building_density'] = tmp.apply(
-        lambda row: -1 if row['district_square_km2'] == 0 else row['total_buildings'] / row['district_square_km2'], axis=1)
-    tmp['median_levels'].fillna(0, inplace = True)
-    tmp['apartments_rate'] = tmp.apply(
-        lambda row: 0 if row['total_buildings'] == 0 else round(row['apartments_number'] / row['total_buildings'], 2), axis=1
-    )
     to_drop = ['total_buildings', 'district_square_km2', 'apartments_number']
     tmp.drop(columns = to_drop, inplace = True)
     
-    cols = list(set(tmp.columns))
-    tmp = tmp[cols]
-    
-    return tmp
-
-
-
-
-
-
-
-
-
+    return apply_schema(tmp)